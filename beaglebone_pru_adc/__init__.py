@@ -1,50 +1,80 @@
-import _pru_adc
 import glob
-import re
 import os
-import mmap
+import math
 import struct
 import time
 import array
+import collections
+import ctypes
+import select
+import threading
+import weakref
 
+from beaglebone_pru_adc import layout
 
-SLOTS = glob.glob('/sys/devices/bone_capemgr.*/slots')[0]
+try:
+	from beaglebone_pru_adc import _pru_adc
+except ImportError:
+	_pru_adc = None # extension is not built (e.g. not a BeagleBone). Only simulated backend is usable
 
+_monotonic = getattr(time, 'monotonic', time.time) # clock for timeouts, Python 2 has no time.monotonic()
 
-def _is_pru_loaded():
-	with open(SLOTS, 'r') as f:
-		for line in f:
-			if re.search(r'BB-BONE-PRU-01', line):
-				return True
-    
-	return False
 
-def _is_adc_loaded():
-	with open(SLOTS, 'r') as f:
-		for line in f:
-			if re.search(r'BB-ADC', line):
-				return True
-    
-	return False
+CAPES = ('BB-BONE-PRU-01', 'BB-ADC') # device tree overlays the firmware needs
+CAPE_TIMEOUT = 5.0 # seconds to wait for overlays to load
 
-def _ensure_pru_loaded():
-	if _is_pru_loaded():
-		return
-    
-	with open(SLOTS, 'w') as f:
-		f.write('BB-BONE-PRU-01')
-	time.sleep(0.2) # let things settle before using this driver
+_capes_lock = threading.Lock()
+_capes_ready = False # set once overlays are known to be loaded, never checked again
+_slots_path = None # cached path of the cape manager slots file, '' if there is none
+
+
+def _slots():
+	"""
+	Returns path of the cape manager slots file, or None on systems without cape manager. Looked up once
+	"""
+	global _slots_path
+	if _slots_path is None:
+		found = glob.glob('/sys/devices/bone_capemgr.*/slots')
+		_slots_path = found[0] if found else ''
+	return _slots_path or None
+
+
+def _missing_capes(slots):
+	"""
+	Returns list of CAPES that are not listed in the slots file
+	"""
+	with open(slots, 'r') as f:
+		text = f.read()
+	return [name for name in CAPES if name not in text]
 
-def _ensure_adc_loaded():
-	if _is_adc_loaded():
-		return
-    
-	with open(SLOTS, 'w') as f:
-		f.write('BB-ADC')
-	time.sleep(0.2) # let things settle before using this driver
 
-_ensure_pru_loaded()
-_ensure_adc_loaded()
+def _pru_ready():
+	return os.path.exists('/dev/uio0') # opened by prussdrv_open()
+
+
+def _ensure_capes_loaded(timeout=CAPE_TIMEOUT):
+	"""
+	Loads PRU and ADC overlays if they are not loaded yet, and waits until they are listed and the PRU device
+	shows up (at most `timeout` seconds, then raises IOError). Called by HardwareBackend, the outcome is cached
+	"""
+	global _capes_ready
+	with _capes_lock:
+		if _capes_ready:
+			return
+		slots = _slots()
+		if slots is not None: # no cape manager: overlays are loaded some other way (or this is not a BeagleBone)
+			missing = _missing_capes(slots)
+			for name in missing:
+				with open(slots, 'w') as f:
+					f.write(name)
+			deadline = _monotonic() + timeout
+			while missing or not _pru_ready():
+				if _monotonic() > deadline:
+					raise IOError("device tree overlays did not load: " + ', '.join(missing or ['uio_pruss device']))
+				time.sleep(0.01)
+				missing = _missing_capes(slots)
+		_capes_ready = True
+
 
 # Useful offsets from firmware.h
 OFF_FLAG        = 0x0008
@@ -68,142 +98,778 @@ OFF_SCOPE_OFFSET= 0x0010
 OFF_SCOPE_SIZE  = 0x0014
 OFF_DEBUG       = 0x0018
 OFF_CAP_DELAY   = 0x00c4
+OFF_SEQ         = 0x00c8
+OFF_STREAM_SIZE = 0x00cc
+OFF_STREAM_HEAD = 0x00d0
+OFF_FRAME_COUNT = 0x00d4
+OFF_FRAME_OFFSETS = 0x00d8
+OFF_TIMESTAMP   = 0x0118
+OFF_EVT_MASK    = 0x011c
+OFF_EVT_SCOPE_HALF = 0x0120
+OFF_EVT_LEVEL_OFFSET = 0x0124
+OFF_EVT_LEVEL   = 0x0128
+OFF_EVT_ABOVE   = 0x012c
+OFF_EVT_COUNT   = 0x0130
+OFF_CHANNELS    = 0x0144
+OFF_STEP_CONFIG = 0x0148
+OFF_STEP_DELAY  = 0x0168
+OFF_PACE_PERIOD = 0x0188
+OFF_PACE_START  = 0x018c
+OFF_PACE_MAX_LATE = 0x0190
+OFF_PACE_OVERRUNS = 0x0194
+OFF_EMA_POWS    = 0x0198
+OFF_CONFIG_GEN  = 0x01b8
+OFF_CONFIG_ACK  = 0x01bc
+OFF_ENC_MAP     = 0x01c0
+OFF_ENC_MAPS    = 0x01c4
+OFF_ENC_EXT     = 0x0204
+OFF_TICK_RING   = 0x0384
+OFF_STATS_ENABLE = 0x0784
+OFF_STATS_RESET = 0x0788
+OFF_STATS_RESET_ACK = 0x078c
+OFF_STATS       = 0x0794
+OFF_PERF        = 0x0894
+OFF_PERF_RESET_ACK = 0x0898
 
+MAX_ENCODERS    = 8
+TICK_RING       = 32 # number of last ticks that firmware remembers for every encoder
 
-class Capture(_pru_adc.Capture):
-    
+# Event kinds. Firmware interrupts host on events which bit (1 << kind) is set in Capture.event_mask
+EVT_TICK        = 0 # wheel encoder tick (any encoder)
+EVT_SCOPE_HALF  = 1 # oscilloscope buffer is half full
+EVT_SCOPE_FULL  = 2 # oscilloscope buffer is full (in streaming mode: firmware wraps around)
+EVT_THRESHOLD   = 3 # watched word crossed the level (see Capture.threshold_init())
+EVT_QUIT        = 4 # firmware exited (always interrupts host)
+
+IEP_CLOCK_HZ    = 200000000 # frequency of the PRU IEP timer that makes time stamps
+
+
+RateStats = collections.namedtuple('RateStats', 'rate_hz jitter overruns')
+ChannelStats = collections.namedtuple('ChannelStats', 'count min max mean variance rms peak_to_peak')
+PerfCounters = collections.namedtuple('PerfCounters',
+	'loops loop_last loop_min loop_max fifo_wait process fifo_overflow fifo_underflow scope_dropped')
+ThresholdState = collections.namedtuple('ThresholdState', 'threshold delay low high drift updates intervals idle')
+
+# properties that can be changed with Capture.reconfigure(), in the order they are applied
+_LIVE_SETTINGS = (
+	'encoder_pins', 'encoder0_pin', 'encoder1_pin',
+	'encoder0_threshold', 'encoder1_threshold',
+	'encoder0_delay', 'encoder1_delay',
+	'ema_pow', 'cap_delay', 'sample_rate_hz',
+)
+
+
+class OverrunError(IOError):
+	"""
+	Raised by Capture.stream() when firmware has overwritten oscilloscope samples that were not consumed yet
+	"""
+
+
+def _uint32_view(mem, byte_offset, count):
+	"""
+	Zero-copy view of `count` 32-bit words of `mem` starting at `byte_offset`. This is a memoryview
+	where memoryview.cast() is available (Python 3), and ctypes array otherwise
+	"""
+	if hasattr(memoryview, 'cast'):
+		return memoryview(mem)[byte_offset:byte_offset+4*count].cast('I')
+	return (ctypes.c_uint32 * count).from_buffer(mem, byte_offset)
+
+
+class HardwareBackend(object):
+	"""
+	Runs firmware on the real PRU0 (via _pru_adc extension). Local memory (PRU0 data RAM) and DDR memory
+	are the ones mapped by prussdrv
+	"""
+	
 	def __init__(self):
-		self._mem = None
-		_pru_adc.Capture.__init__(self)
+		self.mem = None
+		if _pru_adc is None:
+			raise IOError("_pru_adc extension is not available on this system")
+		_ensure_capes_loaded()
+		self._driver = _pru_adc.Capture()
 		
-		with open('/sys/class/uio/uio0/maps/map0/addr') as f:
-			self._mem_addr = int(f.read().strip(), 16)
-        
-		with open('/sys/class/uio/uio0/maps/map0/size') as f:
-			self._mem_size = int(f.read().strip(), 16)
+		self.mem = self._driver.dataram()
+		self.fast = self._driver # C accessors of the hot fields (timer, values, encoder ticks...)
+		self.ddr = self._driver.extmem()
+		self.ddr_addr = self._driver.extmem_phys_addr()
+		self.ddr_size = len(self.ddr)
+	
+	def start(self, firmware):
+		self._quit_count = self._get_quit_count()
+		self._driver.start(firmware)
+	
+	def wait(self, timeout=None):
+		# events enabled in EVT_MASK interrupt host too, keep waiting until firmware exits. With no events
+		# enabled only exit interrupts host: then do not rely on EVT_QUIT counter (firmware may not keep it)
+		deadline = None if timeout is None else _monotonic() + timeout
+		while self._get_quit_count() == self._quit_count:
+			remaining = None if deadline is None else max(0.0, deadline - _monotonic())
+			if not self._driver.wait(remaining):
+				return False
+			if not struct.unpack_from('=L', self.mem, OFF_EVT_MASK)[0]:
+				break
+		return True
+	
+	def fileno(self):
+		return self._driver.fileno()
+	
+	def clear_event(self):
+		fd = self._driver.fileno()
+		if select.select([fd], [], [], 0)[0]:
+			os.read(fd, 4) # consume interrupt count
+		self._driver.clear_event()
+	
+	def _get_quit_count(self):
+		return struct.unpack_from('=L', self.mem, OFF_EVT_COUNT + 4*EVT_QUIT)[0]
+	
+	def close(self):
+		self.ddr = None
+		self.mem = None
+		self.fast = None
+		self._driver.close() # this unmaps PRU and DDR memory
+
+
+def _encoder_offset(index):
+	"""
+	Byte offset of enc_local block of the encoder `index` (0-7)
+	"""
+	return OFF_ENC0_THRESH + 64*index if index < 2 else OFF_ENC_EXT + 64*(index - 2)
+
+_ENCODER_OFFSETS = tuple(_encoder_offset(i) for i in range(MAX_ENCODERS))
+
+
+class Encoder(object):
+	"""
+	Wheel encoder: ADC channel that firmware runs through the Schmitt trigger instead of EMA. Encoders are
+	Capture.encoders[0] - Capture.encoders[MAX_ENCODERS-1], an encoder is off until its `pin` is set
+	"""
+	
+	def __init__(self, capture, index):
+		self._capture = capture
+		self.index = index
+		self._offset = _ENCODER_OFFSETS[index]
+		self._view = capture._view(capture._mem, self._offset + 4, 5)
+	
+	@property
+	def pin(self):
+		"""
+            AIN channel (0-7) of this encoder, None if the encoder is off
+            """
+		return self._capture._encoder_pins[self.index]
+	
+	@pin.setter
+	def pin(self, value):
+		pins = list(self._capture._encoder_pins)
+		pins[self.index] = value
+		self._capture.encoder_pins = pins
+	
+	@property
+	def threshold(self):
+		return self._capture._get_word(self._offset)
+	
+	@threshold.setter
+	def threshold(self, value):
+		self._capture._set_word(self._offset, value)
+	
+	@property
+	def delay(self):
+		return self._capture._get_word(self._offset + 28)
+	
+	@delay.setter
+	def delay(self, value):
+		self._capture._set_word(self._offset + 28, value)
+	
+	@property
+	def values(self):
+		"""
+            Returns (raw, min, max, ticks, speed) tuple
+            """
+		fast = self._capture._fast
+		if fast is not None:
+			return fast.encoder_values(self.index)
+		return self._capture._get_words(self._offset + 4, "=LLLLL")
+	
+	@property
+	def view(self):
+		"""
+            Zero-copy view of encoder values (raw, min, max, ticks, speed), see Capture.values_view
+            """
+		return self._view
+	
+	@property
+	def ticks(self):
+		fast = self._capture._fast
+		if fast is not None:
+			return fast.encoder_ticks(self.index)
+		return self._capture._get_word(self._offset + 16)
+	
+	@property
+	def speed(self):
+		fast = self._capture._fast
+		if fast is not None:
+			return fast.encoder_speed(self.index)
+		return self._capture._get_word(self._offset + 20)
+	
+	def ticks_since(self, cursor=None):
+		"""
+            Returns (cursor, timers): `timer` values of the ticks that happened after `cursor` (as array.array('I'), oldest
+            first), and the new cursor to pass to the next call. Cursor is the number of ticks seen so far, None means "now".
+            Firmware remembers the last TICK_RING ticks only, if more happened since `cursor` the older ones are lost:
+            then the cursor advances by more than len(timers)
+            """
+		capture = self._capture
+		ring = OFF_TICK_RING + 4 * TICK_RING * self.index
+		while True:
+			seq = capture._get_word(OFF_SEQ)
+			head = capture._get_word(self._offset + 16)
+			data = capture._mem[ring:ring + 4 * TICK_RING]
+			if not seq & 1 and capture._get_word(OFF_SEQ) == seq:
+				break
+		if cursor is None:
+			cursor = head
+		count = min((head - cursor) & 0xffffffff, TICK_RING)
+		words = struct.unpack('=%dL' % TICK_RING, data)
+		timers = array.array('I', [words[(head - count + i) % TICK_RING] for i in range(count)])
+		return head, timers
+	
+	def _state(self, snap):
+		"""
+            enc_local_t of this encoder in a snapshot() of local memory
+            """
+		return snap.enc_local[self.index] if self.index < 2 else snap.enc_ext[self.index - 2]
+	
+	@property
+	def quadrature(self):
+		"""
+            Index of the encoder that is channel B of the quadrature pair where this encoder is channel A,
+            None if this encoder is not channel A of a pair. Assign None to break the pair
+            """
+		quad = self._capture._get_word(self._offset + 44)
+		if not quad or quad & 1:
+			return None
+		return _ENCODER_OFFSETS.index(quad)
+	
+	@quadrature.setter
+	def quadrature(self, index):
+		if index is not None and (not 0 <= index < MAX_ENCODERS or index == self.index):
+			raise ValueError("quadrature partner must be another encoder (0-%d)" % (MAX_ENCODERS - 1))
+		self._unpair(self._offset)
+		if index is None:
+			return
+		partner = _ENCODER_OFFSETS[index]
+		self._unpair(partner)
+		self._capture._set_word(partner + 44, self._offset | 1)
+		self._capture._set_word(self._offset + 44, partner)
+	
+	def _unpair(self, offset):
+		capture = self._capture
+		quad = capture._get_word(offset + 44)
+		if quad:
+			capture._set_word((quad & ~1) + 44, 0)
+		capture._set_word(offset + 44, 0)
+	
+	@property
+	def position(self):
+		"""
+            Quadrature position: signed count of edges of both channels, as seen by channel A of the pair.
+            Counting starts from the state where both channels are low
+            """
+		return self._capture._get_words(self._offset + 48, "=l")[0]
+	
+	@property
+	def direction(self):
+		"""
+            Direction of the last quadrature step: 1 (A leads B) or -1 (B leads A). Zero before the first step
+            """
+		return self._capture._get_words(self._offset + 52, "=l")[0]
+
+
+def _encoder_alias(index, name):
+	"""
+	Capture property that forwards to `name` attribute of Capture.encoders[index] (encoder0_*, encoder1_* API)
+	"""
+	def fget(self):
+		return getattr(self.encoders[index], name)
+	def fset(self, value):
+		setattr(self.encoders[index], name, value)
+	return property(fget, fset)
+
+
+def _encoder_pin_alias(index):
+	"""
+	encoder0_pin and encoder1_pin: -1 means "off", as well as any other out-of-range pin number
+	"""
+	def fget(self):
+		pin = self.encoders[index].pin
+		return -1 if pin is None else pin
+	def fset(self, value):
+		self.encoders[index].pin = value if value is not None and 0 <= value < 8 else None
+	return property(fget, fset)
+
+
+class ThresholdTracker(object):
+	"""
+	Keeps `threshold` and `delay` of the encoders adjusted to their signals (see Capture.auto_threshold_init()).
+
+	Every update() reads statistics of the encoder channels collected by firmware since the previous update (and resets them).
+	The envelope of the signal is the lowest min and the highest max of the last `window` updates where the signal moved by at
+	least `min_range`, and threshold is set to `ratio` of the envelope. Delay is set to `delay_ratio` of the shortest tick seen
+	since the previous update, but not more than `max_delay` (delay_ratio=None leaves delays alone).
+	Pass `encoders` (sequence of indices) to track some encoders only, by default all encoders that have a pin.
+
+	Tracker owns statistics: it turns them on and resets them on every update.
+	"""
+	
+	def __init__(self, capture, encoders=None, window=10, ratio=0.7, min_range=200, delay_ratio=0.1, max_delay=250):
+		if not 0 < ratio < 1:
+			raise ValueError("ratio must be between 0 and 1")
+		if window < 1:
+			raise ValueError("window must be positive")
+		self._capture = capture
+		self._encoders = None if encoders is None else set(encoders)
+		self.window = window
+		self.ratio = ratio
+		self.min_range = min_range
+		self.delay_ratio = delay_ratio
+		self.max_delay = max_delay
+		self._tracks = {}
+		self._thread = None
+		self._stopping = threading.Event()
+		capture.stats_enabled = True
+		capture.stats_reset()
+	
+	def update(self):
+		"""
+            Adjusts thresholds and delays to the signals seen since the previous update
+            """
+		stats = self._capture.stats(reset=True)
+		for encoder in self._capture.encoders:
+			if encoder.pin is None or (self._encoders is not None and encoder.index not in self._encoders):
+				continue
+			track = self._tracks.get(encoder.index)
+			if track is None:
+				track = self._tracks[encoder.index] = _ThresholdTrack(encoder, self.window)
+			track.update(encoder, stats[encoder.pin], self)
+	
+	def state(self):
+		"""
+            Returns dictionary {encoder index: ThresholdState(threshold, delay, low, high, drift, updates, intervals, idle)}:
+            current settings, signal envelope, drift of the middle of the envelope since the first update, number of
+            changes made to the settings, number of updates and number of updates when the signal did not move
+            """
+		return dict((index, track.state()) for index, track in self._tracks.items())
+	
+	def start(self, interval):
+		"""
+            Calls update() every `interval` seconds in a background thread
+            """
+		if self._thread is not None:
+			raise IOError("Already started")
+		self._stopping.clear()
+		self._thread = threading.Thread(target=self._run, args=(interval,))
+		self._thread.daemon = True
+		self._thread.start()
+	
+	def stop(self):
+		if self._thread is not None:
+			self._stopping.set()
+			self._thread.join()
+			self._thread = None
+	
+	def _run(self, interval):
+		while not self._stopping.wait(interval):
+			self.update()
+
+
+class _ThresholdTrack(object):
+	"""
+	ThresholdTracker state of one encoder
+	"""
+	
+	def __init__(self, encoder, window):
+		self.ranges = collections.deque(maxlen=window)
+		self.cursor = encoder.ticks_since(None)[0]
+		self.origin = None
+		self.threshold = encoder.threshold
+		self.delay = encoder.delay
+		self.low = self.high = None
+		self.drift = 0.0
+		self.updates = self.intervals = self.idle = 0
+	
+	def update(self, encoder, stats, tracker):
+		self.intervals += 1
+		self.cursor, timers = encoder.ticks_since(self.cursor)
 		
-		with open('/sys/class/uio/uio0/maps/map1/addr') as f:
-			self._ddr_addr = int(f.read().strip(), 16)
-        
-		with open('/sys/class/uio/uio0/maps/map1/size') as f:
-			self._ddr_size = int(f.read().strip(), 16)
-        
-		with open("/dev/mem", 'r+b') as f1:
-			self._mem = mmap.mmap(f1.fileno(), self._mem_size, offset=self._mem_addr)
-	
-	def __del__(self):
-		if self._mem:
-			self._mem.close()
+		if stats is None or stats.peak_to_peak < tracker.min_range:
+			self.idle += 1 # wheel does not turn: nothing to learn from this interval
+			return
+		self.ranges.append((stats.min, stats.max))
+		self.low = min(low for low, _ in self.ranges)
+		self.high = max(high for _, high in self.ranges)
+		middle = (self.low + self.high) / 2.0
+		if self.origin is None:
+			self.origin = middle
+		self.drift = middle - self.origin
+		
+		threshold = int(tracker.ratio * (self.high - self.low))
+		if threshold != encoder.threshold:
+			encoder.threshold = threshold
+			self.updates += 1
+		self.threshold = threshold
+		
+		if tracker.delay_ratio is not None and len(timers) > 1:
+			shortest = min((b - a) & 0xffffffff for a, b in zip(timers, timers[1:]))
+			delay = min(tracker.max_delay, int(shortest * tracker.delay_ratio))
+			if delay != encoder.delay:
+				encoder.delay = delay
+				self.updates += 1
+		self.delay = encoder.delay
+	
+	def state(self):
+		return ThresholdState(self.threshold, self.delay, self.low, self.high, self.drift, self.updates, self.intervals, self.idle)
+
+
+class Capture(object):
+    
+	def __init__(self, backend=None):
+		"""
+            Creates capture driver. By default it runs on the PRU hardware (HardwareBackend). Pass
+            an alternative backend (e.g. beaglebone_pru_adc.sim.SimulatedBackend) to run elsewhere.
+            """
+		if backend is None:
+			backend = HardwareBackend()
+		self._backend = backend
+		self._mem = backend.mem
+		self._fast = getattr(backend, 'fast', None) # C accessors of hot fields, if backend has them
+		self._ddr = backend.ddr
+		self._ddr_addr = backend.ddr_addr
+		self._ddr_size = backend.ddr_size
+		
+		self._views = weakref.WeakValueDictionary() # all views into backend memory, released on close()
+		self._locals = layout.locals_t.from_buffer(self._mem) # live view of the PRU local memory
+		self._snapshot = layout.locals_t()
+		self._values_view = self._view(self._mem, OFF_VALUES, 8)
+		self.encoders = tuple(Encoder(self, i) for i in range(MAX_ENCODERS))
+		self._encoder_pins = self._read_encoder_pins() # host copy of the pins in the active encoders.map
+		self._encoder_map_changed = False
+		self._scope_offsets = None # list of offsets when oscilloscope records multi-word frames
+		self._scope_timestamps = False # True when oscilloscope frames start with a time stamp
+		self._stream_clock = None # (IEP count, IEP ticks since start) of the last streamed sample
+		self._stream_tail = 0 # number of streamed oscilloscope samples consumed so far
+		self._scope_dropped = 0 # number of streamed oscilloscope samples lost to overruns since perf counters reset
+		self._event_counts = self._get_event_counts() # event counts seen by the last events() call
+		self._quit_count = self._event_counts[EVT_QUIT] # firmware has halted when EVT_QUIT count changes
+		self._rate_mark = None # (timer, timestamp) seen by the last rate_stats() call
+		self._started = False
+		self._reconfiguring = False # True while reconfigure() collects changes into one update
+		self._threshold_tracker = None
     
 	def start(self):
 		firmware = os.path.dirname(__file__) + '/firmware/firmware.bin'
-		_pru_adc.Capture.start(self, firmware)
+		self._quit_count = self._get_event_counts()[EVT_QUIT]
+		self._rate_mark = None
+		self._backend.start(firmware)
+		self._started = True
 	
 	def stop(self):
 		self._set_word(OFF_FLAG, 1) # exit flag
+	
+	def wait(self, timeout=None):
+		"""
+            Blocks until firmware halts, at most `timeout` seconds (forever if None). Other Python threads keep running
+            while we wait. Returns True if firmware halted, False on timeout
+            """
+		return self._backend.wait(timeout)
+	
+	def fileno(self):
+		"""
+            Returns file descriptor that becomes readable when firmware raises an event enabled in `event_mask`
+            (or exits). Use it with select/poll/epoll, then call events()
+            """
+		return self._backend.fileno()
+	
+	def events(self):
+		"""
+            Acknowledges event notification and returns dictionary {event kind: number of events} of the events
+            that happened since the previous call (all kinds are reported, not only the ones in `event_mask`).
+            """
+		self._backend.clear_event() # re-arm notification first, so that no event goes unnoticed
+		counts = self._get_event_counts()
+		out = {}
+		for kind, (count, seen) in enumerate(zip(counts, self._event_counts)):
+			if count != seen:
+				out[kind] = (count - seen) & 0xffffffff
+		self._event_counts = counts
+		return out
+	
+	def _halted(self):
+		return self._get_event_counts()[EVT_QUIT] != self._quit_count
+	
+	def _get_event_counts(self):
+		return struct.unpack_from('=%dL' % layout.NUM_EVENTS, self._mem, OFF_EVT_COUNT)
+	
+	@property
+	def event_mask(self):
+		return self._get_word(OFF_EVT_MASK)
+	
+	@event_mask.setter
+	def event_mask(self, value):
+		self._set_word(OFF_EVT_MASK, value)
+	
+	def threshold_init(self, offset, level):
+		"""
+            Sets up EVT_THRESHOLD event: it fires when the word at `offset` goes above `level`, or comes back
+            to it. Pass None as `offset` to turn it off
+            """
+		self._set_word(OFF_EVT_LEVEL_OFFSET, 0)
+		if offset is None:
+			return
+		self._set_word(OFF_EVT_LEVEL, level)
+		self._set_word(OFF_EVT_ABOVE, 1 if self._get_word(offset) > level else 0)
+		self._set_word(OFF_EVT_LEVEL_OFFSET, offset)
     
 	def close(self):
-		_pru_adc.Capture.close(self)
-		self._mem.close()
+		self.auto_threshold_stop()
+		# must release all views into backend memory before backend can unmap it
+		for view in list(self._views.values()):
+			if hasattr(view, 'release'):
+				view.release()
+		self._values_view = None
+		for encoder in self.encoders:
+			encoder._view = None
+		self._locals = None
+		self._fast = None
+		self._backend.close()
 		self._mem = None
+		self._ddr = None
+	
+	def _view(self, buf, byte_offset, count):
+		view = _uint32_view(buf, byte_offset, count)
+		self._views[id(view)] = view
+		return view
+	
+	def snapshot(self):
+		"""
+            Copies the whole local memory block (locals_t) with a single memcpy into a pre-allocated buffer
+            and returns it as ctypes structure mirroring src/firmware.h. Fields are accessed as attributes,
+            e.g. snapshot().timer, snapshot().ain_ema[0], snapshot().enc_local[1].ticks, snapshot().scope.length.
+            
+            Note that the same buffer is reused (and overwritten) by every call.
+            """
+		live = self._locals
+		while True:
+			seq = live.seq
+			ctypes.memmove(ctypes.addressof(self._snapshot), ctypes.addressof(live), ctypes.sizeof(self._snapshot))
+			if not seq & 1 and live.seq == seq:
+				return self._snapshot
 	
 	@property
 	def timer(self):
 		"""
             Returns ADC timer value. This is the number of ADC capture cycles since driver start
             """
+		if self._fast is not None:
+			return self._fast.timer
 		return self._get_word(OFF_TIMER)
 	
 	@property
 	def ema_pow(self):
 		"""
-            Returns EMA exponent. If zero, no EMA averaging
+            Returns EMA exponent. If zero, no EMA averaging. If channels use different exponents,
+            returns a tuple of 8 exponents (one per channel)
             """
-		return self._get_word(OFF_EMA_POW)
+		pows = struct.unpack_from('=8L', self._mem, OFF_EMA_POWS)
+		if len(set(pows)) == 1:
+			return pows[0]
+		return pows
 	
 	@ema_pow.setter
 	def ema_pow(self, value):
-		if 0 <= value <= 31:
-			self._set_word(OFF_EMA_POW, value)
+		if hasattr(value, '__len__'): # any sequence: list, tuple, range, array, numpy array
+			pows = list(value)
+			if len(pows) != 8:
+				raise ValueError("ema_pow sequence must have 8 items, got %d" % len(pows))
 		else:
-			raise ValueError("ema_pow must be in range 0-31")
+			pows = [value] * 8
+		for exponent in pows:
+			if not 0 <= exponent <= 31:
+				raise ValueError("ema_pow must be in range 0-31")
+		struct.pack_into('=8L', self._mem, OFF_EMA_POWS, *pows)
+		self._set_word(OFF_EMA_POW, pows[0] if len(set(pows)) == 1 else 0)
 	
 	@property
-	def values(self):
-		return struct.unpack("LLLLLLLL", self._mem[OFF_VALUES:OFF_VALUES+8*4])
+	def channels(self):
+		mask = self._get_word(OFF_CHANNELS) & 0xff or 0xff
+		return [i for i in range(8) if mask & (1 << i)]
 	
-	@property
-	def encoder0_pin(self):
-		return struct.unpack("b", self._mem[OFF_ENC0_PIN:OFF_ENC0_PIN+1])[0]
+	@channels.setter
+	def channels(self, value):
+		mask = 0
+		for channel in value:
+			if not 0 <= channel < 8:
+				raise ValueError("channel must be in range 0-7")
+			mask |= 1 << channel
+		if not mask:
+			raise ValueError("at least one channel must be enabled")
+		self._set_word(OFF_CHANNELS, mask)
 	
-	@encoder0_pin.setter
-	def encoder0_pin(self, value):
-		struct.pack_into('b', self._mem, OFF_ENC0_PIN, value)
+	def channel_config(self, channel, averaging=None, open_delay=None, sample_delay=None):
+		"""
+            Configures ADC step of AIN `channel`: number of samples averaged by ADC hardware (1, 2, 4, 8 or 16),
+            open delay (0-262143 ADC clocks) and sample delay (0-255 ADC clocks). Arguments left as None are not changed.
+            Returns (averaging, open_delay, sample_delay) tuple of the channel. Takes effect at start().
+            """
+		if not 0 <= channel < 8:
+			raise ValueError("channel must be in range 0-7")
+		config = self._get_word(OFF_STEP_CONFIG + 4*channel)
+		delay = self._get_word(OFF_STEP_DELAY + 4*channel)
+		
+		if averaging is not None:
+			if averaging not in (1, 2, 4, 8, 16):
+				raise ValueError("averaging must be one of 1, 2, 4, 8, 16")
+			config = (config & ~0x1c) | ((averaging.bit_length() - 1) << 2)
+		if open_delay is not None:
+			if not 0 <= open_delay <= 0x3ffff:
+				raise ValueError("open_delay must be in range 0-262143")
+			delay = (delay & ~0x3ffff) | open_delay
+		if sample_delay is not None:
+			if not 0 <= sample_delay <= 0xff:
+				raise ValueError("sample_delay must be in range 0-255")
+			delay = (delay & 0x00ffffff) | (sample_delay << 24)
+		
+		self._set_word(OFF_STEP_CONFIG + 4*channel, config)
+		self._set_word(OFF_STEP_DELAY + 4*channel, delay)
+		return 1 << ((config >> 2) & 7), delay & 0x3ffff, delay >> 24
 	
 	@property
-	def encoder1_pin(self):
-		return struct.unpack("b", self._mem[OFF_ENC1_PIN:OFF_ENC1_PIN+1])[0]
+	def values(self):
+		if self._fast is not None:
+			return self._fast.values
+		return self._get_words(OFF_VALUES, "=LLLLLLLL")
 	
-	@encoder1_pin.setter
-	def encoder1_pin(self, value):
-		struct.pack_into('b', self._mem, OFF_ENC1_PIN, value)
+	def read_values(self, out):
+		"""
+            Copies the 8 ADC values into `out` (any writable buffer of at least 32 bytes: array.array('I', [0] * 8),
+            bytearray, numpy uint32 array...) and returns the timer value of the cycle they come from.
+            Nothing is allocated per call, which suits tight control loops
+            """
+		if self._fast is not None:
+			return self._fast.read_values(out)
+		mem = self._mem
+		while True:
+			seq = self._get_word(OFF_SEQ)
+			timer = self._get_word(OFF_TIMER)
+			values = struct.unpack_from('=8L', mem, OFF_VALUES)
+			if not seq & 1 and self._get_word(OFF_SEQ) == seq:
+				break
+		self._pack_out(out, values)
+		return timer
 	
-	@property
-	def encoder0_threshold(self):
-		return self._get_word(OFF_ENC0_THRESH)
+	def read_encoders(self, out):
+		"""
+            Copies (ticks, speed) of every encoder into `out` (writable buffer of at least 2 * MAX_ENCODERS words:
+            ticks of encoder 0, speed of encoder 0, ticks of encoder 1...) and returns the timer value they are consistent with
+            """
+		if self._fast is not None:
+			return self._fast.read_encoders(out)
+		mem = self._mem
+		while True:
+			seq = self._get_word(OFF_SEQ)
+			timer = self._get_word(OFF_TIMER)
+			words = []
+			for offset in _ENCODER_OFFSETS:
+				words.extend(struct.unpack_from('=LL', mem, offset + 16))
+			if not seq & 1 and self._get_word(OFF_SEQ) == seq:
+				break
+		self._pack_out(out, words)
+		return timer
 	
-	@encoder0_threshold.setter
-	def encoder0_threshold(self, value):
-		self._set_word(OFF_ENC0_THRESH, value)
-    
-	@property
-	def encoder1_threshold(self):
-		return self._get_word(OFF_ENC1_THRESH)
-    
-	@encoder1_threshold.setter
-	def encoder1_threshold(self, value):
-		self._set_word(OFF_ENC1_THRESH, value)
-    
-	@property
-	def encoder0_values(self):
-		return struct.unpack("LLLLL", self._mem[OFF_ENC0_VALUES:OFF_ENC0_VALUES+5*4])
+	@staticmethod
+	def _pack_out(out, words):
+		try:
+			struct.pack_into('=%dL' % len(words), out, 0, *words)
+		except struct.error:
+			raise ValueError("buffer is too small, need %d bytes" % (4 * len(words)))
 	
 	@property
-	def encoder1_values(self):
-		return struct.unpack("LLLLL", self._mem[OFF_ENC1_VALUES:OFF_ENC1_VALUES+5*4])
-    
-	@property
-	def encoder0_delay(self):
-		return self._get_word(OFF_ENC0_DELAY)
+	def values_view(self):
+		"""
+            Zero-copy view of the 8 ADC values (unsigned 32-bit words mapped right onto the PRU memory).
+            Indexing it reads the current value of a channel without any intermediate copies.
+            Do not use views after close(): on Python 3 they are released (using one raises ValueError), on Python 2
+            they are ctypes arrays over unmapped memory and using one is undefined (typically a crash).
+            """
+		return self._values_view
 	
-	@encoder0_delay.setter
-	def encoder0_delay(self, value):
-		self._set_word(OFF_ENC0_DELAY, value)
-    
 	@property
-	def encoder1_delay(self):
-		return self._get_word(OFF_ENC1_DELAY)
-    
-	@encoder1_delay.setter
-	def encoder1_delay(self, value):
-		self._set_word(OFF_ENC1_DELAY, value)
+	def encoder_pins(self):
+		"""
+            Returns tuple of AIN channels of all encoders (None for the encoders that are off).
+            Assign a sequence to change several encoders at once (e.g. to swap pins)
+            """
+		return tuple(self._encoder_pins)
 	
-	@property
-	def encoder0_ticks(self):
-		return self._get_word(OFF_ENC0_TICKS)
-
-	@property
-	def encoder1_ticks(self):
-		return self._get_word(OFF_ENC1_TICKS)
+	@encoder_pins.setter
+	def encoder_pins(self, value):
+		pins = list(value) + [None] * (MAX_ENCODERS - len(value))
+		if len(pins) != MAX_ENCODERS:
+			raise ValueError("there are only %d encoders" % MAX_ENCODERS)
+		for pin in pins:
+			if pin is not None and not 0 <= pin < 8:
+				raise ValueError("encoder pin must be in range 0-7 (or None)")
+		used = [pin for pin in pins if pin is not None]
+		if len(set(used)) != len(used):
+			raise ValueError("two encoders can not share a pin")
+		self._encoder_pins = pins
+		self._encoder_map_changed = True
+		self._config_changed()
 	
-	@property
-	def encoder0_speed(self):
-		return self._get_word(OFF_ENC0_SPEED)
+	def encoder_ticks_since(self, cursor=None, encoder=0):
+		"""
+            Same as encoders[encoder].ticks_since(cursor): returns (cursor, timers) with `timer` values of the ticks
+            of the given encoder that happened after `cursor`
+            """
+		return self.encoders[encoder].ticks_since(cursor)
+	
+	def _read_encoder_pins(self):
+		pins = [None] * MAX_ENCODERS
+		table = struct.unpack_from('=8L', self._mem, self._get_word(OFF_ENC_MAP))
+		for pin, offset in enumerate(table):
+			if offset in _ENCODER_OFFSETS:
+				pins[_ENCODER_OFFSETS.index(offset)] = pin
+		return pins
+	
+	def _write_encoder_map(self):
+		"""
+            Fills the encoders.map that firmware is not using and switches to it (firmware picks it up with the next
+            configuration generation)
+            """
+		table = [0] * 8
+		for index, pin in enumerate(self._encoder_pins):
+			if pin is not None:
+				table[pin] = _ENCODER_OFFSETS[index]
+		target = OFF_ENC_MAPS + 32 if self._get_word(OFF_ENC_MAP) == OFF_ENC_MAPS else OFF_ENC_MAPS
+		struct.pack_into('=8L', self._mem, target, *table)
+		self._set_word(OFF_ENC_MAP, target)
+		for index, offset in ((0, OFF_ENC0_PIN), (1, OFF_ENC1_PIN)):
+			pin = self._encoder_pins[index]
+			struct.pack_into('B', self._mem, offset, 0xff if pin is None else pin)
+	
+	encoder0_pin = _encoder_pin_alias(0)
+	encoder1_pin = _encoder_pin_alias(1)
+	encoder0_threshold = _encoder_alias(0, 'threshold')
+	encoder1_threshold = _encoder_alias(1, 'threshold')
+	encoder0_values = _encoder_alias(0, 'values')
+	encoder1_values = _encoder_alias(1, 'values')
+	encoder0_view = _encoder_alias(0, 'view')
+	encoder1_view = _encoder_alias(1, 'view')
+	encoder0_delay = _encoder_alias(0, 'delay')
+	encoder1_delay = _encoder_alias(1, 'delay')
+	encoder0_ticks = _encoder_alias(0, 'ticks')
+	encoder1_ticks = _encoder_alias(1, 'ticks')
+	encoder0_speed = _encoder_alias(0, 'speed')
+	encoder1_speed = _encoder_alias(1, 'speed')
 	
-	@property
-	def encoder1_speed(self):
-		return self._get_word(OFF_ENC1_SPEED)
-
 	@property
 	def debug_value(self):
 		return self._get_word(OFF_DEBUG)
@@ -215,32 +881,396 @@ class Capture(_pru_adc.Capture):
 	@cap_delay.setter
 	def cap_delay(self, value):
 		self._set_word(OFF_CAP_DELAY, value)
+		self._config_changed()
     
+	@property
+	def sample_rate_hz(self):
+		period = self._get_word(OFF_PACE_PERIOD)
+		return IEP_CLOCK_HZ / float(period) if period else None
+	
+	@sample_rate_hz.setter
+	def sample_rate_hz(self, value):
+		period = int(round(IEP_CLOCK_HZ / float(value))) if value else 0
+		if value and not 0 < period <= 0x7fffffff:
+			raise ValueError("sample rate is out of range")
+		self._set_word(OFF_PACE_PERIOD, period)
+		self._config_changed()
+	
+	def reconfigure(self, timeout=None, **settings):
+		"""
+            Changes several settings (names of Capture properties, e.g. encoder0_pin=2, cap_delay=0, ema_pow=4) while capture
+            is running, without restarting the firmware. Settings that firmware keeps in registers (encoder pins, cap_delay,
+            sample_rate_hz) are switched together, between two capture cycles. Waits at most `timeout` seconds for firmware
+            to pick them up (by default 1 second or two sample periods, whichever is longer), raises IOError if it does not.
+            """
+		for name in settings:
+			if name not in _LIVE_SETTINGS:
+				raise TypeError("reconfigure() got an unexpected setting '%s'" % name)
+		
+		running = self._started and not self._halted()
+		if timeout is None:
+			timeout = self._config_timeout() # cycle that picks the change up is paced with the old period
+		if running:
+			self._wait_config_ack(timeout) # previous update must be latched before we touch the values
+		self._reconfiguring = True
+		try:
+			for name in _LIVE_SETTINGS:
+				if name in settings:
+					setattr(self, name, settings[name])
+		finally:
+			self._reconfiguring = False
+			self._config_changed()
+		if running:
+			self._wait_config_ack(timeout)
+	
+	def _config_changed(self):
+		if self._reconfiguring:
+			return
+		if self._encoder_map_changed:
+			if self._started and not self._halted():
+				self._wait_config_ack(self._config_timeout()) # firmware may still use the map we are about to fill
+			self._encoder_map_changed = False
+			self._write_encoder_map()
+		self._set_word(OFF_CONFIG_GEN, (self._get_word(OFF_CONFIG_GEN) + 1) & 0xffffffff)
+	
+	def _config_timeout(self):
+		# firmware picks a change up at the start of a cycle, which can be a whole sample period away
+		return max(1.0, 2.0 * self._get_word(OFF_PACE_PERIOD) / IEP_CLOCK_HZ)
+	
+	def _wait_config_ack(self, timeout):
+		deadline = _monotonic() + timeout
+		while self._get_word(OFF_CONFIG_ACK) != self._get_word(OFF_CONFIG_GEN):
+			if self._halted():
+				return
+			if _monotonic() > deadline:
+				raise IOError("firmware did not pick up configuration change")
+			time.sleep(0.0001)
+	
+	def rate_stats(self):
+		"""
+            Returns RateStats(rate_hz, jitter, overruns): capture rate achieved since previous call (or since start),
+            worst delay of a cycle start after its schedule (in seconds) and number of cycles that started a whole
+            period late. Jitter and overruns are only measured when sample_rate_hz is set, and start over whenever the
+            schedule does (start() or a new sample_rate_hz).
+            Call it at least every 20 seconds, otherwise the time stamps wrap around.
+            """
+		snap = self.snapshot()
+		timer, clock = self._rate_mark or (0, snap.pace.start)
+		cycles = (snap.timer - timer) & 0xffffffff
+		clocks = (snap.timestamp - clock) & 0xffffffff
+		self._rate_mark = (snap.timer, snap.timestamp)
+		rate = cycles * float(IEP_CLOCK_HZ) / clocks if clocks else None
+		return RateStats(rate, snap.pace.max_late / float(IEP_CLOCK_HZ), snap.pace.overruns)
+	
+	@property
+	def stats_enabled(self):
+		return bool(self._get_word(OFF_STATS_ENABLE))
+	
+	@stats_enabled.setter
+	def stats_enabled(self, value):
+		self._set_word(OFF_STATS_ENABLE, 1 if value else 0)
+	
+	def stats(self, reset=False):
+		"""
+            Returns tuple of 8 ChannelStats(count, min, max, mean, variance, rms, peak_to_peak) of the raw samples of every
+            channel since start or the last reset (None for channels without samples). Firmware collects them only while
+            `stats_enabled` is set. If `reset` is True, accumulators are zeroed right after they have been read
+            """
+		words = self._get_words(OFF_STATS, '=' + 'LLQQQ' * 8)
+		if reset:
+			self.stats_reset()
+		out = []
+		for channel in range(8):
+			vmin, vmax, count, total, squares = words[5*channel:5*channel+5]
+			if not count:
+				out.append(None)
+				continue
+			mean = total / float(count)
+			meansq = squares / float(count)
+			out.append(ChannelStats(count, vmin, vmax, mean, max(0.0, meansq - mean*mean), math.sqrt(meansq), vmax - vmin))
+		return tuple(out)
+	
+	def stats_reset(self, timeout=1.0):
+		"""
+            Asks firmware to zero statistics of all channels. If capture is running, waits at most `timeout` seconds
+            until it does, raises IOError if it does not. Otherwise statistics are zeroed by the next capture cycle
+            """
+		self._request_reset(OFF_STATS_RESET, OFF_STATS_RESET_ACK, timeout, "firmware did not reset statistics")
+	
+	def perf_counters(self, reset=False):
+		"""
+            Returns PerfCounters of the capture loop since start or the last reset. Times are in IEP clocks (see IEP_CLOCK_HZ):
+            loops - number of capture loops; loop_last, loop_min, loop_max - length of the last, shortest and longest loop
+            (None before the first loop is complete); fifo_wait - total time spent waiting for the ADC; process - total
+            time spent in encoder processing; fifo_overflow, fifo_underflow - number of loops that found ADC FIFO
+            overrun/underflow flags set; scope_dropped - number of streamed oscilloscope samples lost because consumer
+            fell behind (all samples skipped on overruns, counted by the host). Firmware updates the counters under the
+            seqlock, so 64-bit sums are never read torn. If `reset` is True, counters are zeroed right after they have been read
+            """
+		words = self._get_words(OFF_PERF, '=LLLLLLLLLQQ')
+		dropped = self._scope_dropped
+		if reset:
+			self.perf_reset()
+		_, _, _, loops, last, vmin, vmax, overflow, underflow, fifo_wait, process = words
+		if not loops:
+			last = vmin = vmax = None
+		return PerfCounters(loops, last, vmin, vmax, fifo_wait, process, overflow, underflow, dropped)
+	
+	def perf_reset(self, timeout=1.0):
+		"""
+            Asks firmware to zero performance counters. If capture is running, waits at most `timeout` seconds
+            until it does, raises IOError if it does not. Otherwise counters are zeroed by the next capture loop
+            """
+		self._scope_dropped = 0
+		self._request_reset(OFF_PERF, OFF_PERF_RESET_ACK, timeout, "firmware did not reset performance counters")
+	
+	def _request_reset(self, reset_offset, ack_offset, timeout, message):
+		reset = (self._get_word(reset_offset) + 1) & 0xffffffff
+		self._set_word(reset_offset, reset)
+		if not self._started:
+			return
+		deadline = _monotonic() + timeout
+		while self._get_word(ack_offset) != reset:
+			if self._halted():
+				return
+			if _monotonic() > deadline:
+				raise IOError(message)
+			time.sleep(0.0001)
+	
+	def auto_threshold_init(self, interval=0.5, **options):
+		"""
+            Starts adjusting thresholds and delays of the encoders to their signals every `interval` seconds, in a background
+            thread. See ThresholdTracker for `options`. Statistics (see stats()) are used and reset by the tracker.
+            """
+		self.auto_threshold_stop()
+		tracker = ThresholdTracker(self, **options)
+		tracker.start(interval)
+		self._threshold_tracker = tracker
+		return tracker
+	
+	def auto_threshold_stop(self):
+		if self._threshold_tracker is not None:
+			self._threshold_tracker.stop()
+			self._threshold_tracker = None
+	
+	def auto_threshold_state(self):
+		"""
+            Returns {encoder index: ThresholdState} of the automatic threshold tracking (empty if it is not running)
+            """
+		if self._threshold_tracker is None:
+			return {}
+		return self._threshold_tracker.state()
+	
 	def _set_word(self, byte_offset, value):
-		struct.pack_into('L', self._mem, byte_offset, value)
+		struct.pack_into('=L', self._mem, byte_offset, value)
 	
 	def _get_word(self, byte_offset):
-		return struct.unpack("L", self._mem[byte_offset:byte_offset+4])[0]
+		return struct.unpack("=L", self._mem[byte_offset:byte_offset+4])[0]
 	
-	def oscilloscope_init(self, offset, numsamples):
-		if numsamples * 4 > self._ddr_size:
-			raise ValueError("numsamples is too large. Limit is (determined by DDR memory size): " + str(self._ddr_size//4))
+	def _get_words(self, byte_offset, fmt):
+		"""
+            Reads several words that firmware updates together. Retries until read is not torn by
+            a concurrent firmware update (see seqlock description in src/README.md)
+            """
+		mem = self._mem
+		size = struct.calcsize(fmt)
+		while True:
+			seq = self._get_word(OFF_SEQ)
+			data = mem[byte_offset:byte_offset+size]
+			if not seq & 1 and self._get_word(OFF_SEQ) == seq:
+				return struct.unpack(fmt, data)
+	
+	def oscilloscope_init(self, offset, numsamples, streaming=False, timestamps=False):
+		"""
+            Sets up oscilloscope capture of `numsamples` values of the word at `offset`. If `offset` is a sequence
+            of offsets (up to 16), every capture cycle records a frame with all these words.
+            If `streaming` is True, DDR buffer is used as a ring of `numsamples` values (frames) that is written
+            continuously until capture is stopped (use stream() to consume it).
+            If `timestamps` is True, every frame also records the time when its values were sampled
+            (see oscilloscope_time()). This takes one of the 16 frame words.
+            """
+		if isinstance(offset, (list, tuple)):
+			offsets = list(offset)
+			if not 0 < len(offsets) <= layout.MAX_FRAME_WORDS - bool(timestamps):
+				raise ValueError("number of offsets must be in range 1-%d" % (layout.MAX_FRAME_WORDS - bool(timestamps)))
+			offset = offsets[0]
+		else:
+			offsets = None
+		words = ([OFF_TIMESTAMP] if timestamps else []) + (offsets or [offset])
+		framesize = 4 * len(words)
+		if numsamples * framesize > self._ddr_size:
+			raise ValueError("numsamples is too large. Limit is (determined by DDR memory size): " + str(self._ddr_size//framesize))
+		
 		self._set_word(OFF_SCOPE_ADDR, self._ddr_addr)
 		self._set_word(OFF_SCOPE_OFFSET, offset)
-		self._set_word(OFF_SCOPE_SIZE, numsamples * 4)
+		if len(words) > 1 or offsets is not None:
+			for i, off in enumerate(words):
+				self._set_word(OFF_FRAME_OFFSETS + 4*i, off)
+			self._set_word(OFF_FRAME_COUNT, len(words))
+		else:
+			self._set_word(OFF_FRAME_COUNT, 0)
+		self._scope_offsets = offsets
+		self._scope_timestamps = bool(timestamps)
+		self._stream_clock = None
+		self._set_word(OFF_EVT_SCOPE_HALF, (numsamples - numsamples // 2) * framesize)
+		self._set_word(OFF_STREAM_SIZE, numsamples * framesize if streaming else 0)
+		self._set_word(OFF_STREAM_HEAD, 0)
+		self._stream_tail = 0
+		self._set_word(OFF_SCOPE_SIZE, numsamples * framesize)
     
 	def oscilloscope_is_complete(self):
+		if self._fast is not None:
+			return self._fast.scope_length == 0
 		return self._get_word(OFF_SCOPE_SIZE) == 0
 	
-	def oscilloscope_data(self, numsamples):
-		out = array.array('L')
-		with open("/dev/mem", 'r+b') as f1:
-			ddr_offset = 0
-			ddr_addr = self._ddr_addr
-			if ddr_addr >= 0x80000000: # workaround of mmap bug
-				ddr_offset = 0x70000000
-				ddr_addr -= ddr_offset
-			ddr = mmap.mmap(f1.fileno(), self._ddr_size + ddr_offset, offset=ddr_addr)
-			out.fromstring(ddr[ddr_offset:ddr_offset + 4*numsamples])
-			ddr.close()
+	def oscilloscope_data(self, numsamples, out=None):
+		"""
+            Returns array of `numsamples` captured values. If oscilloscope was set up with a sequence of offsets,
+            returns a list of arrays, one per offset.
+            
+            If `out` is given (any writable buffer: array.array('I'), bytearray, numpy array...), captured words
+            are copied into it as they are (multi-word frames are not de-interleaved) and `out` is returned.
+            """
+		nbytes = self._scope_framesize() * numsamples
+		if out is None:
+			data = array.array('I', [0]) * (nbytes // 4)
+			self._ddr_copy(data, nbytes)
+			return self._scope_split(data)
+		self._ddr_copy(out, nbytes)
 		return out
+	
+	def oscilloscope_view(self, numsamples):
+		"""
+            Same as oscilloscope_data(), but returns zero-copy view(s) of DDR memory instead of arrays.
+            Do not use views after close(), see values_view.
+            """
+		return self._scope_split(self._view(self._ddr, 0, self._scope_framesize() * numsamples // 4))
+	
+	def oscilloscope_time(self, numsamples):
+		"""
+            Returns array of `numsamples` sample times in seconds, relative to the first sample. Oscilloscope must be
+            set up with timestamps=True. Time stamps come from a 32-bit 200MHz counter that wraps around every ~21s,
+            wrap-arounds are accounted for as long as there is less than that between consecutive samples.
+            """
+		if not self._scope_timestamps:
+			raise ValueError("oscilloscope is not initialized with timestamps")
+		counts = self._view(self._ddr, 0, self._scope_framesize() * numsamples // 4)
+		return self._scope_seconds(counts[::self._scope_framesize() // 4])[0]
+	
+	def _scope_seconds(self, counts, clock=None):
+		"""
+            Converts IEP counts into array of seconds. `clock` is (count, ticks) of the preceding sample,
+            returns the array and (count, ticks) of the last sample
+            """
+		if clock is None:
+			clock = (counts[0] if len(counts) else 0, 0)
+		last, ticks = clock
+		out = array.array('d', [0.0]) * len(counts)
+		for i, count in enumerate(counts):
+			ticks += (count - last) & 0xffffffff
+			last = count
+			out[i] = ticks / float(IEP_CLOCK_HZ)
+		return out, (last, ticks)
+	
+	def _ddr_copy(self, out, nbytes, byte_offset=0):
+		dst = (ctypes.c_char * nbytes).from_buffer(out)
+		src = (ctypes.c_char * nbytes).from_buffer(self._ddr, byte_offset)
+		ctypes.memmove(dst, src, nbytes)
+	
+	def _scope_framesize(self):
+		return 4 * (len(self._scope_offsets or [0]) + self._scope_timestamps)
+	
+	def _scope_split(self, data):
+		"""
+            De-interleaves multi-word frames into a list of per-offset arrays (time stamps are dropped)
+            """
+		n = self._scope_framesize() // 4
+		if n == 1:
+			return data
+		out = [data[i::n] for i in range(n)]
+		for x in out:
+			if hasattr(x, 'release'): # strided memoryview into backend memory
+				self._views[id(x)] = x
+		if self._scope_timestamps:
+			out = out[1:]
+		if self._scope_offsets is None:
+			return out[0]
+		return out
+	
+	def stream(self, chunksize=None, poll_interval=0.001):
+		"""
+            Generator that yields streamed oscilloscope samples (see oscilloscope_init(streaming=True)) as zero-copy
+            views of consecutive values in DDR memory (lists of per-offset views for multi-word frames). A chunk is
+            only valid until the next iteration, copy it if needed. Each chunk has at least `chunksize` samples (default is 1/8 of the ring size),
+            except when firmware has halted: then the rest of the data is yielded and generator finishes.
+            Chunks are never longer than the distance to the end of the ring buffer.
+            
+            If oscilloscope was set up with timestamps=True, yields (time, chunk) tuples, where `time` is array of
+            sample times in seconds since the first streamed sample.
+            
+            Raises OverrunError if consumer fell behind and firmware has overwritten the data that was not
+            consumed yet (including the chunk consumer was working on). All samples that were not consumed are
+            skipped and counted as lost. Calling stream() again resumes streaming from the latest sample.
+            """
+		capacity = self._stream_capacity()
+		if chunksize is None:
+			chunksize = max(1, capacity // 8)
+		if not 0 < chunksize <= capacity:
+			raise ValueError("chunksize must be in range 1-%d" % capacity)
+		
+		while True:
+			halted = self._halted() # check before reading head: halted firmware writes nothing after that
+			available = self._stream_available(capacity)
+			if available < chunksize:
+				if not halted:
+					time.sleep(poll_interval)
+					continue
+				if available == 0: # capture stopped and all data was consumed
+					return
+			
+			count, chunk = self._stream_chunk(capacity, available)
+			yield chunk
+			self._stream_consumed(capacity, count, halted)
+	
+	def _stream_capacity(self):
+		capacity = self._get_word(OFF_STREAM_SIZE) // self._scope_framesize()
+		if capacity == 0:
+			raise ValueError("oscilloscope is not initialized for streaming")
+		return capacity
+	
+	def _stream_available(self, capacity):
+		head = self._fast.stream_head if self._fast is not None else self._get_word(OFF_STREAM_HEAD)
+		available = (head - self._stream_tail) & 0xffffffff
+		if available > capacity:
+			self._stream_overrun(available, capacity)
+		return available
+	
+	def _stream_chunk(self, capacity, available):
+		"""
+            Returns (number of samples, chunk) for the next chunk of at most `available` samples
+            """
+		framesize = self._scope_framesize()
+		pos = self._stream_tail % capacity
+		count = min(available, capacity - pos)
+		data = self._view(self._ddr, framesize*pos, framesize*count // 4)
+		if self._scope_timestamps:
+			seconds, self._stream_clock = self._scope_seconds(data[::framesize // 4], self._stream_clock)
+			return count, (seconds, self._scope_split(data))
+		return count, self._scope_split(data)
+	
+	def _stream_consumed(self, capacity, count, halted=False):
+		"""
+            Marks `count` samples at the tail as consumed. Raises OverrunError if they were overwritten while consumer
+            was looking at them. Firmware writes a frame before it advances the head, so with the whole ring available
+            the frame at the tail may already be half overwritten, unless firmware had `halted` before the chunk was taken
+            """
+		available = self._stream_available(capacity)
+		if available == capacity and not halted:
+			self._stream_overrun(available, capacity)
+		self._stream_tail += count
+	
+	def _stream_overrun(self, available, capacity):
+		# consumer skips to the head: everything it has not consumed yet (including a chunk it was given) is lost
+		self._stream_tail += available
+		self._scope_dropped += available
+		raise OverrunError("oscilloscope stream overrun, %d samples lost" % available)
@@ -0,0 +1,175 @@
+"""
+asyncio integration for beaglebone_pru_adc.Capture (Python 3.7+).
+
+AsyncCapture registers Capture.fileno() with the event loop, so coroutines are woken up by firmware events
+(see Capture.event_mask) instead of sleeping and polling.
+
+Usage:
+
+	import asyncio
+	import beaglebone_pru_adc as adc
+	from beaglebone_pru_adc import aio
+
+	async def main():
+		capture = aio.AsyncCapture(adc.Capture())
+		capture.capture.encoder0_pin = 0
+		capture.capture.start()
+		async for tick in capture.encoder_ticks(0):
+			print(tick.ticks, tick.speed)
+			if tick.ticks >= 100:
+				break
+		await capture.stop()
+		capture.close()
+
+	asyncio.run(main())
+"""
+import asyncio
+import collections
+
+import beaglebone_pru_adc as adc
+
+TickEvent = collections.namedtuple('TickEvent', 'ticks speed timer')
+
+
+class AsyncCapture(object):
+	"""
+	Wraps Capture object for use from asyncio coroutines. Any number of iterators and stop() can be active at
+	the same time, they all share one registration of the event file descriptor. Create it from a coroutine
+	(or pass `loop`). Capture.events() counts are left to the caller.
+	"""
+
+	def __init__(self, capture, loop=None):
+		self.capture = capture
+		self._loop = loop or asyncio.get_running_loop()
+		self._waiters = []
+		self._users = collections.Counter() # number of running iterators that need each event kind
+		self._owned = set() # event kinds enabled by iterators (restored when the last of them finishes)
+		self._fd = capture.fileno()
+		self._loop.add_reader(self._fd, self._on_event)
+
+	def close(self):
+		"""
+		Unregisters from the event loop. Does not close the wrapped Capture
+		"""
+		if self._fd is not None:
+			self._loop.remove_reader(self._fd)
+			self._fd = None
+		for waiter in self._waiters:
+			waiter.cancel()
+		self._waiters = []
+
+	def _on_event(self):
+		# re-arm notification only: waiters look at firmware state themselves, event counts stay for Capture.events()
+		self.capture._backend.clear_event()
+		waiters, self._waiters = self._waiters, []
+		for waiter in waiters:
+			if not waiter.done():
+				waiter.set_result(None)
+
+	def _next_event(self):
+		"""
+		Returns a future that is resolved on the next firmware notification
+		"""
+		waiter = self._loop.create_future()
+		self._waiters.append(waiter)
+		return waiter
+
+	def _enable(self, *kinds):
+		"""
+		Enables event `kinds` in Capture.event_mask for an iterator, which calls _restore() with the same kinds
+		when it finishes
+		"""
+		mask = self.capture.event_mask
+		for kind in kinds:
+			if not self._users[kind] and not mask & (1 << kind):
+				self._owned.add(kind) # enabled by us, not by the user
+			self._users[kind] += 1
+			mask |= 1 << kind
+		self.capture.event_mask = mask
+
+	def _restore(self, *kinds):
+		"""
+		Disables event `kinds` enabled by _enable() once no iterator needs them
+		"""
+		mask = self.capture.event_mask if self.capture._mem is not None else None
+		for kind in kinds:
+			self._users[kind] -= 1
+			if not self._users[kind] and kind in self._owned:
+				self._owned.discard(kind)
+				if mask is not None:
+					mask &= ~(1 << kind)
+		if mask is not None: # capture may be closed before the iterator is finalized
+			self.capture.event_mask = mask
+
+	async def encoder_ticks(self, encoder=0):
+		"""
+		Asynchronous iterator of TickEvent(ticks, speed, timer) for the given encoder (0-7). Yields every time
+		encoder ticks (several ticks may be reported at once if consumer is slow) and finishes when firmware halts
+		"""
+		capture = self.capture
+		state_of = capture.encoders[encoder]._state
+		self._enable(adc.EVT_TICK)
+		try:
+			last = state_of(capture.snapshot()).ticks
+			while True:
+				halted = capture._halted()
+				snap = capture.snapshot()
+				state = state_of(snap)
+				if state.ticks != last:
+					last = state.ticks
+					yield TickEvent(state.ticks, state.speed, snap.timer)
+				elif halted:
+					return
+				else:
+					await self._next_event()
+		finally:
+			self._restore(adc.EVT_TICK)
+
+	async def stream(self, chunksize=None):
+		"""
+		Asynchronous version of Capture.stream(). Firmware notifies us when the ring buffer is half full and full,
+		therefore `chunksize` can not exceed half of the ring (and this is the default). Chunks end at these two
+		points, so that the notification that follows a chunk always finds the data that is left behind
+		"""
+		capture = self.capture
+		capacity = capture._stream_capacity()
+		half = capacity // 2 # EVT_SCOPE_HALF fires when this many frames of the ring are written
+		if chunksize is None:
+			chunksize = max(1, capacity // 2)
+		if not 0 < chunksize <= max(1, capacity // 2):
+			raise ValueError("chunksize must be in range 1-%d" % max(1, capacity // 2))
+		self._enable(adc.EVT_SCOPE_HALF, adc.EVT_SCOPE_FULL)
+		try:
+			while True:
+				halted = capture._halted()
+				available = capture._stream_available(capacity)
+				if available < chunksize:
+					if not halted:
+						await self._next_event()
+						continue
+					if available == 0:
+						return
+
+				pos = capture._stream_tail % capacity
+				count, chunk = capture._stream_chunk(capacity, min(available, (half if pos < half else capacity) - pos))
+				yield chunk
+				capture._stream_consumed(capacity, count, halted)
+		finally:
+			self._restore(adc.EVT_SCOPE_HALF, adc.EVT_SCOPE_FULL)
+
+	async def stop(self, timeout=None):
+		"""
+		Asks firmware to exit and waits until it does, at most `timeout` seconds. Returns False on timeout
+		"""
+		capture = self.capture
+		capture.stop()
+
+		async def halted():
+			while not capture._halted():
+				await self._next_event()
+
+		try:
+			await asyncio.wait_for(halted(), timeout)
+		except asyncio.TimeoutError:
+			return False
+		return True
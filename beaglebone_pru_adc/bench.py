@@ -0,0 +1,206 @@
+"""
+Benchmarks of the host side of beaglebone_pru_adc.Capture.
+
+Measures latency of property reads, bulk reads (read_values(), read_encoders()), full-state reads (snapshot()),
+oscilloscope_data() throughput, Capture() construction time and start/stop round trip. Every benchmark is warmed up
+first, then timed repeatedly, and reported as min/mean/percentiles. Results are printed as JSON, so that runs on different releases can be compared.
+
+On a BeagleBone it runs against the PRU (HardwareBackend). Elsewhere it uses sim.SimulatedBackend, that is an mmap
+image standing in for the PRU memory: numbers are then about the Python side of the driver only.
+
+Usage:
+
+	python -m beaglebone_pru_adc.bench [--backend auto|hardware|sim] [--samples N] [--output FILE] [--label TEXT]
+"""
+import argparse
+import array
+import json
+import platform
+import sys
+import time
+
+import beaglebone_pru_adc as adc
+from beaglebone_pru_adc import sim
+
+PROPERTIES = ('values', 'timer', 'encoder0_values', 'encoder1_values') # property reads to measure
+SCOPE_SAMPLES = (100, 1000, 10000, 60000) # oscilloscope_data() sizes to measure (capped by DDR size)
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def percentile(sorted_values, fraction):
+	"""
+	Returns value at `fraction` (0-1) of a sorted list, interpolating between neighbours
+	"""
+	pos = (len(sorted_values) - 1) * fraction
+	lo = int(pos)
+	hi = min(lo + 1, len(sorted_values) - 1)
+	return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize(times):
+	"""
+	Returns dictionary with statistics of a list of timings (seconds)
+	"""
+	times = sorted(times)
+	return {
+		'samples': len(times),
+		'min': times[0],
+		'mean': sum(times) / len(times),
+		'p50': percentile(times, 0.5),
+		'p90': percentile(times, 0.9),
+		'p99': percentile(times, 0.99),
+		'max': times[-1],
+	}
+
+
+def measure(func, samples=200, batch=1, warmup=None):
+	"""
+	Calls `func` `warmup` times (default: tenth of the samples), then times `samples` batches of `batch` calls.
+	Returns summarize() of the time of one call
+	"""
+	if warmup is None:
+		warmup = max(1, samples // 10)
+	for _ in range(warmup * batch):
+		func()
+	times = []
+	for _ in range(samples):
+		start = _clock()
+		for _ in range(batch):
+			func()
+		times.append((_clock() - start) / batch)
+	return summarize(times)
+
+
+def _has_hardware():
+	return adc._pru_adc is not None and adc._slots() is not None
+
+
+def _backend_factory(backend):
+	if backend == 'auto':
+		backend = 'hardware' if _has_hardware() else 'sim'
+	if backend == 'hardware':
+		return backend, adc.HardwareBackend
+	if backend == 'sim':
+		return backend, lambda: sim.SimulatedBackend(source=sim.sine_wave(1000), rate=None)
+	raise ValueError("backend must be one of: auto, hardware, sim")
+
+
+def _bench_reads(capture, samples, results):
+	for name in PROPERTIES:
+		getter = lambda name=name: getattr(capture, name)
+		results['read.' + name] = measure(getter, samples, batch=100)
+
+	out = array.array('I', [0] * 8)
+	results['read.read_values'] = measure(lambda: capture.read_values(out), samples, batch=100)
+	out = array.array('I', [0] * 2 * adc.MAX_ENCODERS)
+	results['read.read_encoders'] = measure(lambda: capture.read_encoders(out), samples, batch=100)
+
+	stats = measure(capture.snapshot, samples, batch=100)
+	stats['per_second'] = 1.0 / stats['mean']
+	results['read.snapshot'] = stats
+
+
+def _bench_scope(capture, samples, results):
+	limit = capture._ddr_size // 4
+	for numsamples in SCOPE_SAMPLES:
+		numsamples = min(numsamples, limit)
+		key = 'oscilloscope_data.%d' % numsamples
+		if key in results:
+			continue
+		stats = measure(lambda: capture.oscilloscope_data(numsamples), max(10, samples // 10))
+		stats['mb_per_s'] = 4 * numsamples / stats['mean'] / 1e6
+		results[key] = stats
+
+
+def _bench_lifecycle(new_backend, samples, results):
+	count = max(5, samples // 20)
+
+	def construct():
+		start = _clock()
+		capture = adc.Capture(backend=new_backend())
+		elapsed = _clock() - start
+		capture.close()
+		return elapsed
+
+	def round_trip():
+		capture = adc.Capture(backend=new_backend())
+		start = _clock()
+		capture.start()
+		capture.stop()
+		if not capture.wait(timeout=5):
+			capture.close()
+			raise IOError("firmware did not stop")
+		elapsed = _clock() - start
+		capture.close()
+		return elapsed
+
+	construct() # warm-up
+	results['capture.construct'] = summarize([construct() for _ in range(count)])
+	round_trip()
+	results['capture.start_stop'] = summarize([round_trip() for _ in range(count)])
+
+
+def run(backend='auto', samples=200):
+	"""
+	Runs all benchmarks and returns the report: dictionary with `backend`, environment description and
+	`results` - statistics of each benchmark, in seconds per call (plus `per_second` or `mb_per_s` where it applies)
+	"""
+	if samples < 1:
+		raise ValueError("samples must be positive")
+	backend, new_backend = _backend_factory(backend)
+	results = {}
+
+	capture = adc.Capture(backend=new_backend())
+	try:
+		capture.encoder_pins = [0, 2]
+		# firmware latches the oscilloscope buffer address at start, so this goes first
+		capture.oscilloscope_init(adc.OFF_TIMER, min(max(SCOPE_SAMPLES), capture._ddr_size // 4))
+		if backend == 'sim':
+			capture._backend.step(100) # populate values, the model does not run while reads are measured
+		else:
+			capture.start()
+		_bench_reads(capture, samples, results)
+		_bench_scope(capture, samples, results)
+		if backend != 'sim':
+			capture.stop()
+			capture.wait(timeout=5)
+	finally:
+		capture.close()
+
+	_bench_lifecycle(new_backend, samples, results)
+
+	return {
+		'backend': backend,
+		'python': platform.python_version(),
+		'implementation': platform.python_implementation(),
+		'machine': platform.machine(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'samples': samples,
+		'results': results,
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark beaglebone_pru_adc host read paths')
+	parser.add_argument('--backend', choices=('auto', 'hardware', 'sim'), default='auto',
+		help='PRU hardware or simulated memory image (default: hardware if available)')
+	parser.add_argument('--samples', type=int, default=200, help='timed samples per benchmark (default: 200)')
+	parser.add_argument('--output', help='write JSON report to this file instead of stdout')
+	parser.add_argument('--label', help='free-form label stored in the report (e.g. release)')
+	args = parser.parse_args(argv)
+
+	report = run(args.backend, args.samples)
+	if args.label:
+		report['label'] = args.label
+	text = json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(text + '\n')
+	else:
+		sys.stdout.write(text + '\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
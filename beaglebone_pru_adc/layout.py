@@ -0,0 +1,170 @@
+"""
+ctypes mirror of the structures in src/firmware.h. Keep the two in sync!
+"""
+import ctypes
+
+word = ctypes.c_uint32
+halfword = ctypes.c_uint16
+byte = ctypes.c_uint8
+
+
+class enc_local_t(ctypes.Structure):
+	_fields_ = [
+		('threshold', word),        # threshold used for detecting wheel encoder ticks
+		('raw', word),              # raw value of encoder
+		('min', word),              # min value for current half-tick
+		('max', word),              # max value for current half-tick
+		('ticks', word),            # count of encoder ticks
+		('speed', word),            # width of last encoder tick in "timer" units, aka inverse speed
+		('acc', word),              # work area for speed computation
+		('delay', word),            # activation delay, in timer units.
+		('uptick_time', word),      # work area for computing uptick delay
+		('downtick_time', word),    # work area for computing downtick delay
+		('level', word),            # state of the Schmitt trigger: 1 - high, 0 - low
+		('quad', word),             # address of the quadrature partner's enc_local, bit 0 set on channel B. Zero: no quadrature
+		('position', ctypes.c_int32), # quadrature position, kept by channel A
+		('direction', ctypes.c_int32), # direction of the last quadrature step: 1 or -1, kept by channel A
+		('tick_ring', word),        # address of the ring of `timer` values of the last TICK_RING ticks (tick n is at [(n-1) % TICK_RING])
+		('reserved', word * 1),
+	]
+
+
+class stats_t(ctypes.Structure):
+	_fields_ = [
+		('min', word),              # smallest raw sample since reset
+		('max', word),              # biggest raw sample since reset
+		('count', ctypes.c_uint64), # number of samples since reset
+		('sum', ctypes.c_uint64),   # sum of raw samples
+		('sumsq', ctypes.c_uint64), # sum of squares of raw samples
+	]
+	_pack_ = 4
+
+
+class scope_t(ctypes.Structure):
+	_fields_ = [
+		('addr', word),             # address of DDR memory bank
+		('offset', word),           # byte offset into local memory to capture for `scope mode
+		('length', word),           # byte size of available DDR mem bank (non-zero triggers `scope capture)
+	]
+
+
+class stream_t(ctypes.Structure):
+	_fields_ = [
+		('size', word),             # byte size of the `scope ring buffer. Non-zero turns on streaming
+		('head', word),             # number of samples (frames) written since streaming started (wraps around at 2^32)
+	]
+
+
+MAX_FRAME_WORDS = 16
+
+class frame_t(ctypes.Structure):
+	_fields_ = [
+		('count', word),            # number of words in a `scope frame. Zero means single word at scope.offset
+		('offsets', word * MAX_FRAME_WORDS), # byte offsets into local memory of the words to capture on every cycle
+	]
+
+
+NUM_EVENTS = 5
+
+class events_t(ctypes.Structure):
+	_fields_ = [
+		('mask', word),             # bit mask of event kinds that raise PRU0_ARM_INTERRUPT
+		('scope_half', word),       # value of scope.length at which EVT_SCOPE_HALF fires
+		('level_offset', word),     # byte offset into local memory of the word to watch for EVT_THRESHOLD (zero disables)
+		('level', word),            # EVT_THRESHOLD fires when watched word goes above or comes back to this level
+		('above', word),            # work area: 1 if watched word is above level
+		('count', word * NUM_EVENTS), # number of events of each kind so far (wraps around at 2^32)
+	]
+
+
+class pace_t(ctypes.Structure):
+	_fields_ = [
+		('period', word),           # capture cycle period in IEP clocks (200MHz). Zero means "as fast as possible". Read at start
+		('start', word),            # IEP count when capture started
+		('max_late', word),         # worst delay of a cycle start after its scheduled time, in IEP clocks
+		('overruns', word),         # number of cycles that started a whole period late (schedule is restarted then)
+	]
+
+
+class config_t(ctypes.Structure):
+	_fields_ = [
+		('gen', word),              # host increments it after changing encoder pins, cap_delay or pace.period
+		('ack', word),              # firmware copies gen here after it has re-latched the configuration
+	]
+
+
+MAX_ENCODERS = 8
+TICK_RING = 32
+
+class encoders_t(ctypes.Structure):
+	_fields_ = [
+		('map', word),              # address of the active maps[] entry. Read at start and when config.gen changes
+		('maps', word * 8 * 2),     # address of the enc_local of the encoder on each AIN channel, zero if not an encoder
+	]
+
+
+class stats_ctl_t(ctypes.Structure):
+	_fields_ = [
+		('enable', word),           # non-zero turns on statistics of raw samples
+		('reset', word),            # host increments it to ask firmware to zero the accumulators
+		('reset_ack', word),        # firmware copies reset here after it has zeroed them (and at start)
+		('reserved', word),
+	]
+
+
+class perf_t(ctypes.Structure):
+	_fields_ = [                    # times are in IEP clocks (5ns, same as PRU cycles)
+		('reset', word),            # host increments it to ask firmware to zero the counters
+		('reset_ack', word),        # firmware copies reset here after it has zeroed them (and at start)
+		('loop_start', word),       # work area: IEP count at the start of the current loop
+		('loops', word),            # number of capture loops since reset
+		('loop_last', word),        # length of the last capture loop
+		('loop_min', word),         # shortest capture loop
+		('loop_max', word),         # longest capture loop
+		('fifo_overflow', word),    # number of loops that found ADC FIFO0 overrun flag set
+		('fifo_underflow', word),   # number of loops that found ADC FIFO0 underflow flag set
+		('fifo_wait', ctypes.c_uint64), # time spent waiting for ADC FIFO0
+		('process', ctypes.c_uint64), # time spent in encoder PROCESS
+		('reserved', word * 3),
+	]
+	_pack_ = 4
+
+
+class enc_t(ctypes.Structure):
+	_fields_ = [
+		('encoder0', byte),         # pin number of first wheel encoder ENC0 (0-7). Informational, firmware uses encoders.map
+		('encoder1', byte),         # pin number of second wheel encoder ENC1 (0-7). Informational, firmware uses encoders.map
+		('reserved', byte * 2),
+	]
+
+
+class locals_t(ctypes.Structure):
+	_fields_ = [
+		('eyecatcher', word),       # eyecacher (for sanity checks)
+		('timer', word),            # timer: counts number of ADC reads
+		('flags', word),            # runtime flags. write 1 to exit capture loop
+		('scope', scope_t),
+		('reserved0', word),
+		('ema_pow', word),          # not used by firmware (see ema_pows), host keeps it equal to the common EMA exponent
+		('ain_ema', word * 8),      # captured and EMA-averaged values of all 8 ADC pins
+		('enc', enc_t),
+		('enc_local', enc_local_t * 2), # local work memory for wheel encoders 0 and 1
+		('cap_delay', word),        # extra delay to control capture frequency
+		('seq', word),              # sequence counter, odd while firmware updates timer/values/encoders (seqlock)
+		('stream', stream_t),
+		('frame', frame_t),
+		('timestamp', word),        # IEP timer value (200MHz clock) at the time current ADC values were captured
+		('events', events_t),
+		('channels', word),         # bit mask of AIN channels to capture (bit 0 - AIN0). Zero means all 8. Read at start
+		('step_config', word * 8),  # extra STEPCONFIG bits of each channel (hardware averaging). Read at start
+		('step_delay', word * 8),   # STEPDELAY register value of each channel (open delay, sample delay). Read at start
+		('pace', pace_t),
+		('ema_pows', word * 8),     # exponent for EMA averaging of each channel: ema += (value - ema/2^ema_pow)
+		('config', config_t),
+		('encoders', encoders_t),
+		('enc_ext', enc_local_t * (MAX_ENCODERS - 2)), # local work memory for wheel encoders 2-7
+		('tick_ring', word * TICK_RING * MAX_ENCODERS), # tick history of each encoder, see enc_local_t.tick_ring
+		('stats_ctl', stats_ctl_t),
+		('stats', stats_t * 8),     # statistics of raw samples of each channel
+		('perf', perf_t),           # performance counters
+	]
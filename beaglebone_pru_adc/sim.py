@@ -0,0 +1,538 @@
+"""
+Simulated backend for beaglebone_pru_adc.Capture.
+
+It lets capture code run on machines without a BeagleBone (development hosts, CI boxes). PRU local memory
+is an mmap image laid out exactly like locals_t in src/firmware.h, and the DDR scope buffer is an anonymous mmap.
+A background thread runs a behavioral model of src/firmware.p against this memory, feeding it samples from
+a waveform source.
+
+Usage:
+
+	import beaglebone_pru_adc as adc
+	from beaglebone_pru_adc import sim
+
+	capture = adc.Capture(backend=sim.SimulatedBackend(source=sim.constant([1000] * 8)))
+"""
+import mmap
+import math
+import os
+import select
+import struct
+import threading
+import time
+
+import beaglebone_pru_adc as adc
+
+PRU_MEM_SIZE    = 0x2000      # size of PRU0 data RAM
+SIM_DDR_ADDR    = 0x9c940000  # fake physical address of the DDR buffer
+SIM_DDR_SIZE    = 0x40000     # typical size of DDR memory given to the uio_pruss driver
+
+EYECATCHER      = 0xbeef1965
+INITIAL_ACC_VAL = 0x7fffffff
+PRU_CLOCK_HZ    = 200000000   # PRU and IEP timer clock
+DELAY_UNIT      = 2.0 / PRU_CLOCK_HZ # one CAPTURE_DELAY iteration is two PRU instructions
+CYCLE_CLOCKS    = 1000        # IEP clocks per capture cycle when simulated rate is unlimited
+
+_MASK = 0xffffffff
+
+_word  = struct.Struct('=L')
+_word2 = struct.Struct('=LL')
+_word3 = struct.Struct('=LLL')
+_word4 = struct.Struct('=LLLL')
+_word8 = struct.Struct('=LLLLLLLL')
+_stats = struct.Struct('=LLQQQ') # min, max, count, sum, sumsq
+_perf  = struct.Struct('=LLLLLLQQ') # loops, loop_last, loop_min, loop_max, fifo_overflow, fifo_underflow, fifo_wait, process
+
+
+def constant(values):
+	"""
+	Waveform source that always returns the same 8 channel values
+	"""
+	values = tuple(values)
+	return lambda timer: values
+
+
+def recorded(frames):
+	"""
+	Waveform source that replays recorded frames (sequence of 8-tuples) in a loop
+	"""
+	frames = [tuple(f) for f in frames]
+	return lambda timer: frames[timer % len(frames)]
+
+
+def square_wave(period, channels=(0,), low=500, high=3500, base=None):
+	"""
+	Waveform source that produces a square wave of the given period (in timer units) on the given channels,
+	the other channels are taken from `base` (8-tuple, zeroes by default). Useful to drive encoder logic.
+	"""
+	base = tuple(base or [0] * 8)
+	half = period // 2
+	lo = list(base)
+	hi = list(base)
+	for c in channels:
+		lo[c] = low
+		hi[c] = high
+	lo = tuple(lo)
+	hi = tuple(hi)
+	return lambda timer: hi if (timer % period) < half else lo
+
+
+def quadrature_wave(period, channels=(0, 1), low=500, high=3500, reverse=False):
+	"""
+	Waveform source of a quadrature encoder: square waves of the given period on channels A and B (`channels`),
+	B lags A by a quarter of the period (A lags B if `reverse` is set). Other channels are zeroes.
+	"""
+	a, b = channels
+	half = period // 2
+	shift = period - period // 4 if reverse else period // 4
+	def source(timer):
+		values = [0] * 8
+		values[a] = high if (timer % period) < half else low
+		values[b] = high if ((timer - shift) % period) < half else low
+		return tuple(values)
+	return source
+
+
+def sine_wave(period, amplitude=2000, offset=2048, channels=range(8)):
+	"""
+	Waveform source that produces a sine wave of the given period (in timer units) on the given channels
+	"""
+	channels = set(channels)
+	def source(timer):
+		v = int(offset + amplitude * math.sin(2 * math.pi * timer / period))
+		return tuple(v if c in channels else 0 for c in range(8))
+	return source
+
+
+def init_locals(mem):
+	"""
+	Writes initial image of locals_t into `mem`, same as _pru_adc.Capture does on the real PRU
+	"""
+	mem[0:PRU_MEM_SIZE] = b'\0' * PRU_MEM_SIZE
+	_word.pack_into(mem, 0, EYECATCHER)
+	_word.pack_into(mem, adc.OFF_ENC0_PIN, 0xffff) # out-of-range pin numbers disable encoder logic
+	for i in range(adc.MAX_ENCODERS):
+		off = adc._encoder_offset(i)
+		_word.pack_into(mem, off, 2000) # threshold
+		_word2.pack_into(mem, off + 20, INITIAL_ACC_VAL, INITIAL_ACC_VAL) # speed, acc
+		_word.pack_into(mem, off + 56, adc.OFF_TICK_RING + 4 * adc.TICK_RING * i) # tick_ring
+	_word.pack_into(mem, adc.OFF_ENC_MAP, adc.OFF_ENC_MAPS)
+
+
+class Firmware(object):
+	"""
+	Behavioral model of src/firmware.p. Each call to cycle() does what one iteration of the CAPTURE loop does.
+	"""
+
+	def __init__(self, mem, ddr, ddr_addr, source, rate=None, irq=None):
+		self.mem = mem
+		self.ddr = ddr
+		self.ddr_addr = ddr_addr
+		self.source = source
+		self.rate = rate
+		self.irq = irq or (lambda: None) # sends PRU0_ARM_INTERRUPT to host
+		self.halted = False
+		self.iep = 0 # IEP timer counter, advances by cycle_clocks every cycle
+		self.clocks = 0 # total IEP clocks elapsed (does not wrap around)
+		self.cycle_clocks = CYCLE_CLOCKS
+		self.period = 0
+		self.deadline = 0
+		self.gen = 0
+
+		# registers latched at START
+		self.out_buff = 0
+		self.encoders = adc.OFF_ENC_MAPS # address of the channel -> enc_local map
+		self.cap_delay = 0
+		self.channels = 0xff
+
+	def boot(self):
+		"""
+		Does what firmware does at START. Returns False if firmware bailed out
+		"""
+		mem = self.mem
+		if _word.unpack_from(mem, 0)[0] != EYECATCHER:
+			self._raise(adc.EVT_QUIT)
+			self.halted = True
+			return False
+
+		self.out_buff = _word.unpack_from(mem, adc.OFF_SCOPE_ADDR)[0]
+		self.channels = _word.unpack_from(mem, adc.OFF_CHANNELS)[0] & 0xff or 0xff
+		self._latch()
+		_word.pack_into(mem, adc.OFF_PACE_START, self.iep)
+		self._stats_clear()
+		self._perf_clear()
+		return True
+
+	def _latch(self):
+		"""
+		Reads configuration that firmware keeps in registers (at START and RECONFIGURE)
+		"""
+		mem = self.mem
+		self.gen = _word.unpack_from(mem, adc.OFF_CONFIG_GEN)[0]
+		self.encoders = _word.unpack_from(mem, adc.OFF_ENC_MAP)[0]
+		self.cap_delay = _word.unpack_from(mem, adc.OFF_CAP_DELAY)[0]
+		self.cycle_clocks = (PRU_CLOCK_HZ // self.rate if self.rate else CYCLE_CLOCKS) + 2 * self.cap_delay
+		self.period = _word.unpack_from(mem, adc.OFF_PACE_PERIOD)[0]
+		self.deadline = self.iep
+		_word2.pack_into(mem, adc.OFF_PACE_MAX_LATE, 0, 0) # new schedule, max_late and overruns start over
+		_word.pack_into(mem, adc.OFF_CONFIG_ACK, self.gen)
+
+	def cycle(self):
+		"""
+		Runs one capture cycle. Returns False if firmware halted (exit flag was set)
+		"""
+		mem = self.mem
+		start = self.iep
+
+		if _word.unpack_from(mem, adc.OFF_CONFIG_GEN)[0] != self.gen:
+			self._latch()
+
+		if self.period:
+			self._pace()
+
+		if mem[adc.OFF_FLAG:adc.OFF_FLAG+1] != b'\0':
+			self._raise(adc.EVT_QUIT)
+			self.halted = True
+			return False
+
+		length = _word.unpack_from(mem, adc.OFF_SCOPE_SIZE)[0]
+		if length:
+			count = _word.unpack_from(mem, adc.OFF_FRAME_COUNT)[0]
+			if count:
+				for i in range(count):
+					offset = _word.unpack_from(mem, adc.OFF_FRAME_OFFSETS + 4 * i)[0]
+					self._scope_write(_word.unpack_from(mem, offset)[0])
+					length = (length - 4) & _MASK
+			else:
+				offset = _word.unpack_from(mem, adc.OFF_SCOPE_OFFSET)[0]
+				self._scope_write(_word.unpack_from(mem, offset)[0])
+				length = (length - 4) & _MASK
+
+			size, head = _word2.unpack_from(mem, adc.OFF_STREAM_SIZE)
+			if size: # publish the frame before notifying host about it
+				_word.pack_into(mem, adc.OFF_STREAM_HEAD, (head + 1) & _MASK)
+
+			if length == _word.unpack_from(mem, adc.OFF_EVT_SCOPE_HALF)[0]:
+				self._raise(adc.EVT_SCOPE_HALF)
+			if not length:
+				self._raise(adc.EVT_SCOPE_FULL)
+				if size:
+					length = size
+					self.out_buff = _word.unpack_from(mem, adc.OFF_SCOPE_ADDR)[0]
+			_word.pack_into(mem, adc.OFF_SCOPE_SIZE, length)
+
+		seq = _word.unpack_from(mem, adc.OFF_SEQ)[0]
+		_word.pack_into(mem, adc.OFF_SEQ, (seq + 1) & _MASK)
+
+		self._tick(self.cycle_clocks)
+		_word.pack_into(mem, adc.OFF_TIMESTAMP, self.iep)
+
+		timer = (_word.unpack_from(mem, adc.OFF_TIMER)[0] + 1) & _MASK
+		_word.pack_into(mem, adc.OFF_TIMER, timer)
+
+		stats, reset, reset_ack = _word3.unpack_from(mem, adc.OFF_STATS_ENABLE)
+		if reset != reset_ack:
+			self._stats_clear()
+
+		encoders = _word8.unpack_from(mem, self.encoders)
+		ema_pows = _word8.unpack_from(mem, adc.OFF_EMA_POWS)
+		for channel, value in enumerate(self.source(timer)):
+			if not self.channels & (1 << channel):
+				continue
+			value &= 0xfff
+			if stats:
+				off = adc.OFF_STATS + 32 * channel
+				vmin, vmax, count, total, squares = _stats.unpack_from(mem, off)
+				_stats.pack_into(mem, off, min(vmin, value), max(vmax, value), (count + 1) & 0xffffffffffffffff,
+					(total + value) & 0xffffffffffffffff, (squares + value * value) & 0xffffffffffffffff)
+			if encoders[channel]:
+				self._process(encoders[channel], value)
+			else:
+				off = adc.OFF_VALUES + 4 * channel
+				ema_value = _word.unpack_from(mem, off)[0]
+				_word.pack_into(mem, off, (ema_value + value - (ema_value >> (ema_pows[channel] & 31))) & _MASK)
+
+		level_offset, level, above = _word3.unpack_from(mem, adc.OFF_EVT_LEVEL_OFFSET)
+		if level_offset:
+			now_above = 1 if _word.unpack_from(mem, level_offset)[0] > level else 0
+			if now_above != above:
+				_word.pack_into(mem, adc.OFF_EVT_ABOVE, now_above)
+				self._raise(adc.EVT_THRESHOLD)
+
+		self._perf(start)
+		_word.pack_into(mem, adc.OFF_SEQ, (seq + 2) & _MASK) # values, statistics and perf counters are consistent
+		return True
+
+	def _perf(self, start):
+		"""
+		Accounts one capture loop in performance counters. ADC FIFO never overflows here and time spent in
+		PROCESS is not modelled: all of the cycle but CAPTURE_DELAY is waiting for the ADC
+		"""
+		mem = self.mem
+		reset, reset_ack = _word2.unpack_from(mem, adc.OFF_PERF)
+		if reset != reset_ack:
+			self._perf_clear()
+		loops, _, vmin, vmax, overflow, underflow, fifo_wait, process = _perf.unpack_from(mem, adc.OFF_PERF + 12)
+		length = (self.iep - start) & _MASK
+		fifo_wait += self.cycle_clocks - 2 * self.cap_delay
+		_perf.pack_into(mem, adc.OFF_PERF + 12, (loops + 1) & _MASK, length, min(vmin, length), max(vmax, length),
+			overflow, underflow, fifo_wait & 0xffffffffffffffff, process)
+
+	def _perf_clear(self):
+		"""
+		Zeroes performance counters and acknowledges perf.reset (see PERF_CLEAR)
+		"""
+		mem = self.mem
+		_perf.pack_into(mem, adc.OFF_PERF + 12, 0, 0, _MASK, 0, 0, 0, 0, 0)
+		_word.pack_into(mem, adc.OFF_PERF_RESET_ACK, _word.unpack_from(mem, adc.OFF_PERF)[0])
+
+	def _stats_clear(self):
+		"""
+		Zeroes statistics of all channels and acknowledges stats_ctl.reset (see STATS_CLEAR)
+		"""
+		mem = self.mem
+		for channel in range(8):
+			_stats.pack_into(mem, adc.OFF_STATS + 32 * channel, _MASK, 0, 0, 0, 0)
+		_word.pack_into(mem, adc.OFF_STATS_RESET_ACK, _word.unpack_from(mem, adc.OFF_STATS_RESET)[0])
+
+	def _tick(self, clocks):
+		self.iep = (self.iep + clocks) & _MASK
+		self.clocks += clocks
+
+	def _pace(self):
+		"""
+		Waits for the scheduled start of the cycle (see CAPTURE_PACE)
+		"""
+		mem = self.mem
+		late = (self.iep - self.deadline) & _MASK
+		if late & 0x80000000: # early
+			self._tick((self.deadline - self.iep) & _MASK)
+			late = 0
+		max_late, overruns = _word2.unpack_from(mem, adc.OFF_PACE_MAX_LATE)
+		self.deadline = (self.deadline + self.period) & _MASK
+		if late >= self.period:
+			overruns = (overruns + 1) & _MASK
+			self.deadline = (self.iep + self.period) & _MASK
+		_word2.pack_into(mem, adc.OFF_PACE_MAX_LATE, max(max_late, late), overruns)
+
+	def _raise(self, kind):
+		"""
+		Counts event and interrupts host if it is enabled in events.mask (see RAISE_EVENT)
+		"""
+		mem = self.mem
+		off = adc.OFF_EVT_COUNT + 4 * kind
+		_word.pack_into(mem, off, (_word.unpack_from(mem, off)[0] + 1) & _MASK)
+		if kind == adc.EVT_QUIT or _word.unpack_from(mem, adc.OFF_EVT_MASK)[0] & (1 << kind):
+			self.irq()
+
+	def _scope_write(self, value):
+		pos = self.out_buff - self.ddr_addr
+		if not 0 <= pos <= len(self.ddr) - 4: # real PRU would overwrite whatever is at that address
+			raise IOError("oscilloscope write outside of DDR at 0x%08x (scope address is latched at start)" % self.out_buff)
+		_word.pack_into(self.ddr, pos, value)
+		self.out_buff = (self.out_buff + 4) & _MASK
+
+	def _process(self, base, value):
+		"""
+		Schmitt trigger logic for the wheel encoder which enc_local block starts at `base` (see PROCESS)
+		"""
+		mem = self.mem
+		speed, acc = _word2.unpack_from(mem, base + 20)
+		acc = (acc + 1) & _MASK
+		_word2.pack_into(mem, base + 20, max(acc, speed), acc)
+
+		threshold, _, vmin, vmax = _word4.unpack_from(mem, base)
+		vmin = min(vmin, value)
+		vmax = max(vmax, value)
+		_word4.pack_into(mem, base, threshold, value, vmin, vmax)
+
+		if value > (vmin + threshold) & _MASK:
+			delay, up, down = _word3.unpack_from(mem, base + 28)
+			up = (up + 1) & _MASK
+			_word3.pack_into(mem, base + 28, delay, up, 0)
+			if up > delay: # TOHIGH
+				_word3.pack_into(mem, base + 28, delay, 0, 0)
+				_word2.pack_into(mem, base + 8, value, value)
+				self._quadrature(base, 1)
+		elif vmax > (value + threshold) & _MASK:
+			delay, up, down = _word3.unpack_from(mem, base + 28)
+			down = (down + 1) & _MASK
+			_word3.pack_into(mem, base + 28, delay, 0, down)
+			if down > delay: # TOLOW
+				_word3.pack_into(mem, base + 28, delay, 0, 0)
+				_word2.pack_into(mem, base + 8, value, value)
+				ticks, speed, acc = _word3.unpack_from(mem, base + 16)
+				_word3.pack_into(mem, base + 16, (ticks + 1) & _MASK, acc, 0)
+				ring = _word.unpack_from(mem, base + 56)[0]
+				_word.pack_into(mem, ring + 4 * (ticks % adc.TICK_RING), _word.unpack_from(mem, adc.OFF_TIMER)[0])
+				self._raise(adc.EVT_TICK)
+				self._quadrature(base, 0)
+		else:
+			_word2.pack_into(mem, base + 32, 0, 0)
+
+	def _quadrature(self, base, level):
+		"""
+		Schmitt trigger of the encoder at `base` switched to `level`, advances quadrature position (see QUADRATURE)
+		"""
+		mem = self.mem
+		_word.pack_into(mem, base + 40, level)
+		quad = _word.unpack_from(mem, base + 44)[0]
+		if not quad:
+			return
+		partner = quad & ~1
+		differ = _word.unpack_from(mem, partner + 40)[0] != level
+		if quad & 1: # we are channel B: moving forward if B equals A
+			forward = not differ
+			base = partner
+		else: # channel A: moving forward if A differs from B
+			forward = differ
+		position = _word.unpack_from(mem, base + 48)[0]
+		position = (position + (1 if forward else -1)) & _MASK
+		_word2.pack_into(mem, base + 48, position, 1 if forward else _MASK)
+
+
+class SimulatedBackend(object):
+	"""
+	Capture backend that runs Firmware model in a background thread.
+
+	Parameters:
+
+	* `source` - waveform source: a callable that takes timer value and returns 8 raw ADC values (0-4095).
+		See constant(), recorded(), square_wave() and sine_wave(). Default is all zeroes.
+	* `rate` - capture cycles per second to simulate (the real PRU does about 200K). None means "as fast as possible".
+	* `path` - if given, PRU memory image is mmap-ed from this file (so that other processes can look at it),
+		otherwise anonymous memory is used.
+	* `ddr_size` - size of the simulated DDR memory buffer
+
+	Interrupts are delivered through a pipe, so that fileno() can be used with select/poll just like
+	the uio device of the real PRU.
+	"""
+
+	def __init__(self, source=None, rate=200000, path=None, ddr_size=SIM_DDR_SIZE):
+		self.mem = None
+		self._file = None
+		if path is not None:
+			self._file = open(path, 'w+b')
+			self._file.truncate(PRU_MEM_SIZE)
+			self.mem = mmap.mmap(self._file.fileno(), PRU_MEM_SIZE)
+		else:
+			self.mem = mmap.mmap(-1, PRU_MEM_SIZE)
+		init_locals(self.mem)
+
+		self.ddr_addr = SIM_DDR_ADDR
+		self.ddr_size = ddr_size
+		self.ddr = mmap.mmap(-1, ddr_size)
+
+		self.rate = rate
+		self._irq_r, self._irq_w = os.pipe()
+		self._irq_pending = False
+		self._irq_lock = threading.Lock() # clear_event() must not swallow an interrupt raised while it drains the pipe
+		self.firmware = Firmware(self.mem, self.ddr, self.ddr_addr, source or constant([0] * 8), rate, self._irq)
+
+		self._thread = None
+		self._booted = False
+		self._closing = False
+		self._error = None # exception that stopped the model thread, raised by wait()
+
+	def start(self, firmware):
+		"""
+		Starts firmware model. `firmware` (path to the firmware binary) is ignored
+		"""
+		if self._thread is not None:
+			raise IOError("Already started")
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def wait(self, timeout=None):
+		"""
+		Blocks until firmware model halts, at most `timeout` seconds. Returns False on timeout
+		"""
+		if self._thread is None:
+			raise IOError("Not started")
+		deadline = None if timeout is None else adc._monotonic() + timeout
+		while self._thread.is_alive():
+			remaining = 0.1 if deadline is None else min(0.1, deadline - adc._monotonic())
+			if remaining <= 0:
+				return False
+			self._thread.join(remaining) # join with timeout to stay responsive to KeyboardInterrupt
+		if self._error is not None:
+			raise self._error
+		return True
+
+	def close(self):
+		if self._thread is not None:
+			self._closing = True
+			self._thread.join()
+		self.mem.close()
+		self.mem = None
+		self.ddr.close()
+		if self._file is not None:
+			self._file.close()
+		os.close(self._irq_r)
+		os.close(self._irq_w)
+
+	def fileno(self):
+		return self._irq_r
+
+	def clear_event(self):
+		with self._irq_lock:
+			while select.select([self._irq_r], [], [], 0)[0]:
+				os.read(self._irq_r, 64)
+			self._irq_pending = False
+
+	def _irq(self):
+		with self._irq_lock:
+			if not self._irq_pending: # interrupts coalesce until host clears them
+				self._irq_pending = True
+				os.write(self._irq_w, b'!')
+
+	def step(self, cycles=1):
+		"""
+		Runs `cycles` capture cycles synchronously in the calling thread. Use it instead of start() for
+		deterministic tests. Returns False if firmware halted
+		"""
+		if self._thread is not None:
+			raise IOError("Already started")
+		firmware = self.firmware
+		if not self._booted:
+			self._booted = True
+			if not firmware.boot():
+				return False
+		for _ in range(cycles):
+			if firmware.halted or not firmware.cycle():
+				return False
+		return True
+
+	def _run(self):
+		try:
+			self._simulate()
+		except Exception as e: # firmware model failed (e.g. wrote outside of DDR)
+			self._error = e
+
+	def _simulate(self):
+		firmware = self.firmware
+		self._booted = True
+		if not firmware.boot():
+			return
+
+		batch = max(1, (self.rate or 100000) // 1000) # cycles per ~1ms of simulated time
+		started = adc._monotonic()
+		clocks = firmware.clocks
+
+		while not self._closing:
+			for _ in range(batch):
+				if not firmware.cycle():
+					return
+
+			if not self.rate:
+				time.sleep(0) # let host threads run
+				continue
+
+			# keep simulated IEP clock in step with the wall clock
+			deadline = started + (firmware.clocks - clocks) / float(PRU_CLOCK_HZ)
+			now = adc._monotonic()
+			if deadline > now:
+				time.sleep(deadline - now)
+			else:
+				time.sleep(0) # behind schedule, just run as fast as we can
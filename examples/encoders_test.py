@@ -1,6 +1,6 @@
 import beaglebone_pru_adc as adc
 import contextlib
-import time
+import select
 
 @contextlib.contextmanager
 def init_capture(threshold0, threshold1, delay=0):
@@ -12,6 +12,7 @@ def init_capture(threshold0, threshold1, delay=0):
 	capture.encoder1_thredhold = threshold1
 	capture.encoder0_delay = delay
 	capture.encoder1_delay = delay
+	capture.event_mask = 1 << adc.EVT_TICK # wake us up on every encoder tick
 	capture.start()
 
 	yield capture
@@ -26,6 +27,9 @@ with init_capture(2000, 2000, 200) as c:
 	enc1_ticks = c.encoder1_ticks
 
 	while True:
+		select.select([c], [], []) # sleeps until firmware raises an event
+		c.events()
+
 		v0 = c.encoder0_ticks
 		v1 = c.encoder1_ticks
 
@@ -36,5 +40,3 @@ with init_capture(2000, 2000, 200) as c:
 			enc1_speed = 10000. / c.encoder1_speed
 
 			print '%8d[%4.2lf] %8d[%4.2lf]' % (enc0_ticks, enc0_speed, enc1_ticks, enc1_speed)
-
-		time.sleep(0.001)
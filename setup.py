@@ -27,10 +27,12 @@ setup(name             = 'beaglebone_pru_adc',
       packages         = find_packages(),
       py_modules       = ['beaglebone_pru_adc'],
       package_data     = {'beaglebone_pru_adc': ['firmware/*.bin']},
+      entry_points     = {'console_scripts': ['beaglebone_pru_adc_bench = beaglebone_pru_adc.bench:main']},
       ext_modules      = [
           Extension('beaglebone_pru_adc._pru_adc', 
               ['src/pru_adc.c', 'prussdrv/prussdrv.c'],
-              include_dirs = ['prussdrv', 'src']
+              include_dirs = ['prussdrv', 'src'],
+              libraries = ['rt'] # clock_gettime() on older glibc
           )
       ] 
 )
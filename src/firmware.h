@@ -17,9 +17,22 @@ typedef struct {
 	word delay;					// activation delay, in timer units.
 	word uptick_time;			// work area for computing uptick delay
 	word downtick_time;			// work area for computing downtick delay
-	word reserved[6];
+	word level;					// state of the Schmitt trigger: 1 - high, 0 - low
+	word quad;					// address of the quadrature partner's enc_local, bit 0 set on channel B. Zero: no quadrature
+	word position;				// quadrature position (signed), kept by channel A
+	word direction;				// direction of the last quadrature step: 1 or -1, kept by channel A
+	word tick_ring;				// address of the ring of `timer` values of the last TICK_RING ticks (tick n is at [(n-1) % TICK_RING])
+	word reserved[1];
 } enc_local_t;
 
+typedef struct {
+	word min;					// smallest raw sample since reset
+	word max;					// biggest raw sample since reset
+	word count[2];				// number of samples since reset (low word, high word)
+	word sum[2];				// sum of raw samples (low word, high word)
+	word sumsq[2];				// sum of squares of raw samples (low word, high word)
+} stats_t;
+
 /*
  * Local memory of the firmware
  */
@@ -37,18 +50,102 @@ typedef struct {
 	
 	word reserved0;
 	
-	word ema_pow;				// exponent for EMA averaging: ema += (value - ema/2^ema_pow)
+	word ema_pow;				// not used by firmware (see ema_pows), host keeps it equal to the common EMA exponent
 	
 	word ain_ema[8];			// captured and EMA-averaged values of all 8 ADC pins
 	
 	struct {
-		byte encoder0;			// pin number of first wheel encoder ENC0 (0-7)
-		byte encoder1;			// pin number of second wheel encoder ENC1 (0-7)
+		byte encoder0;			// pin number of first wheel encoder ENC0 (0-7). Informational, firmware uses encoders.map
+		byte encoder1;			// pin number of second wheel encoder ENC1 (0-7). Informational, firmware uses encoders.map
 		byte reserved[2];
 	} enc;
 	
-	enc_local_t enc_local[2];	// local work memory for each wheel encoder
+	enc_local_t enc_local[2];	// local work memory for wheel encoders 0 and 1
 	word cap_delay;				// extra delay to control capture frequency
+	word seq;					// sequence counter, odd while firmware updates timer/values/encoders (seqlock)
+	
+	struct {
+		word size;				// byte size of the `scope ring buffer. Non-zero turns on streaming: DDR bank is reused in a loop
+		word head;				// number of samples (frames) written since streaming started (wraps around at 2^32)
+	} stream;
+	
+	struct {
+#define MAX_FRAME_WORDS 16
+		word count;				// number of words in a `scope frame. Zero means single word at scope.offset
+		word offsets[MAX_FRAME_WORDS]; // byte offsets into local memory of the words to capture on every cycle
+	} frame;
+	
+	word timestamp;				// IEP timer value (200MHz clock) at the time current ADC values were captured
+	
+	struct {
+#define EVT_TICK       0		// wheel encoder tick (any encoder)
+#define EVT_SCOPE_HALF 1		// `scope buffer is half full
+#define EVT_SCOPE_FULL 2		// `scope buffer is full (in streaming mode: firmware wraps around)
+#define EVT_THRESHOLD  3		// watched word crossed the level
+#define EVT_QUIT       4		// firmware exits (always interrupts host)
+#define NUM_EVENTS     5
+		word mask;				// bit mask of event kinds that raise PRU0_ARM_INTERRUPT
+		word scope_half;		// value of scope.length at which EVT_SCOPE_HALF fires
+		word level_offset;		// byte offset into local memory of the word to watch for EVT_THRESHOLD (zero disables)
+		word level;				// EVT_THRESHOLD fires when watched word goes above or comes back to this level
+		word above;				// work area: 1 if watched word is above level
+		word count[NUM_EVENTS];	// number of events of each kind so far (wraps around at 2^32)
+	} events;
+	
+	word channels;				// bit mask of AIN channels to capture (bit 0 - AIN0). Zero means all 8. Read at start
+	
+	word step_config[8];		// extra STEPCONFIG bits of each channel (hardware averaging). Read at start
+	word step_delay[8];			// STEPDELAY register value of each channel (open delay, sample delay). Read at start
+	
+	struct {
+		word period;			// capture cycle period in IEP clocks (200MHz). Zero means "as fast as possible". Read at start
+		word start;				// IEP count when capture started
+		word max_late;			// worst delay of a cycle start after its scheduled time, in IEP clocks
+		word overruns;			// number of cycles that started a whole period late (schedule is restarted then)
+	} pace;
+	
+	word ema_pows[8];			// exponent for EMA averaging of each channel: ema += (value - ema/2^ema_pow)
+	
+	struct {
+		word gen;				// host increments it after changing encoder pins, cap_delay or pace.period
+		word ack;				// firmware copies gen here after it has re-latched the configuration
+	} config;
+	
+	struct {
+#define MAX_ENCODERS 8
+		word map;				// address of the active maps[] entry. Read at start and when config.gen changes
+		word maps[2][8];		// address of the enc_local of the encoder on each AIN channel, zero if channel is not
+								// an encoder. Host fills the inactive map and switches to it
+	} encoders;
+	
+	enc_local_t enc_ext[MAX_ENCODERS - 2]; // local work memory for wheel encoders 2-7
+	
+#define TICK_RING 32
+	word tick_ring[MAX_ENCODERS][TICK_RING]; // tick history of each encoder, see enc_local_t.tick_ring
+	
+	struct {
+		word enable;			// non-zero turns on statistics of raw samples
+		word reset;				// host increments it to ask firmware to zero the accumulators
+		word reset_ack;			// firmware copies reset here after it has zeroed them (and at start)
+		word reserved;
+	} stats_ctl;
+	
+	stats_t stats[8];			// statistics of raw samples of each channel
+	
+	struct {					// performance counters. Times are in IEP clocks (5ns, same as PRU cycles)
+		word reset;				// host increments it to ask firmware to zero the counters
+		word reset_ack;			// firmware copies reset here after it has zeroed them (and at start)
+		word loop_start;		// work area: IEP count at the start of the current loop
+		word loops;				// number of capture loops since reset
+		word loop_last;			// length of the last capture loop
+		word loop_min;			// shortest capture loop
+		word loop_max;			// longest capture loop
+		word fifo_overflow;		// number of loops that found ADC FIFO0 overrun flag set
+		word fifo_underflow;	// number of loops that found ADC FIFO0 underflow flag set
+		word fifo_wait[2];		// time spent waiting for ADC FIFO0 (64 bit: low word, high word)
+		word process[2];		// time spent in encoder PROCESS (64 bit: low word, high word)
+		word reserved[3];
+	} perf;
 	
 } locals_t;
 
@@ -9,11 +9,56 @@
 #define STEP1   0x0064
 #define DELAY1  0x0068
 #define STATUS  0x0044
+#define IRQSTATUS_RAW 0x0024
+#define IRQSTATUS   0x0028
 #define STEPCONFIG  0x0054
 #define FIFO0COUNT  0x00e4
 
 #define ADC_FIFO0DATA   (ADC_BASE + 0x0100)
 
+// IEP timer (constant table entry C26). Counts at 200MHz
+#define IEP_GLOBAL_CFG  0x0000
+#define IEP_COUNT       0x000c
+
+// Offsets of locals_t fields (see firmware.h)
+#define OFF_SEQ     0x00c8
+#define OFF_STREAM_SIZE 0x00cc
+#define OFF_STREAM_HEAD 0x00d0
+#define OFF_FRAME_COUNT 0x00d4
+#define OFF_FRAME_OFFSETS 0x00d8
+#define OFF_TIMESTAMP   0x0118
+#define OFF_EVT_MASK    0x011c
+#define OFF_EVT_SCOPE_HALF 0x0120
+#define OFF_EVT_LEVEL_OFFSET 0x0124
+#define OFF_EVT_ABOVE   0x012c
+#define OFF_EVT_COUNT   0x0130
+#define OFF_CHANNELS    0x0144
+#define OFF_STEP_CONFIG 0x0148
+#define OFF_PACE_PERIOD 0x0188
+#define OFF_PACE_START  0x018c
+#define OFF_PACE_MAX_LATE 0x0190
+#define OFF_EMA_POWS    0x0198
+#define OFF_CONFIG_GEN  0x01b8
+#define OFF_CONFIG_ACK  0x01bc
+#define OFF_ENC_MAP     0x01c0
+#define OFF_STATS_CTL   0x0784
+#define OFF_STATS_RESET 0x0788
+#define OFF_STATS       0x0794
+#define OFF_STATS_END   0x0894
+#define OFF_PERF        0x0894
+#define OFF_PERF_START  0x089c
+#define OFF_PERF_FIFO_WAIT 0x08b8
+#define OFF_PERF_PROCESS 0x08c0
+
+#define TICK_RING_MASK 31                // TICK_RING - 1 (see firmware.h)
+
+// Event kinds (bit numbers in events.mask, indices in events.count)
+#define EVT_TICK        0
+#define EVT_SCOPE_HALF  1
+#define EVT_SCOPE_FULL  2
+#define EVT_THRESHOLD   3
+#define EVT_QUIT        4
+
 // Register allocations
 #define adc_  r6
 #define fifo0data r7
@@ -22,9 +67,24 @@
 
 #define value r10
 #define channel   r11
-#define ema   r12
-#define encoders  r13
+#define ema   r12                       // address of the per-channel EMA exponents table
+#define encoders  r13                   // address of the channel -> enc_local map (see encoders.map)
 #define cap_delay r14
+#define seq       r15
+
+#define evt       r16                   // RAISE_EVENT argument: event kind
+#define evt_ret   r17                   // RAISE_EVENT return address
+#define evt_tmp0  r18
+#define evt_tmp1  r19
+#define steps     r20                   // STEPENABLE value: bit (n+1) enables AINn
+#define nchannels r21                   // number of enabled channels (FIFO entries per capture cycle)
+#define period    r22                   // capture cycle period in IEP clocks (zero: no pacing)
+#define deadline  r23                   // IEP count at which next capture cycle is scheduled to start
+#define gen       r24                   // generation of the configuration latched in registers
+#define stats     r0                    // non-zero if statistics are on (stats_ctl.enable, read every cycle)
+#define stat      r25                   // address of stats_t of the channel being processed
+#define mark      r25                   // IEP count when PROCESS was called (shares r25 with `stat`, used after it)
+                                        // r25-r29 belong to the MAC: operands in r28, r29, product in r26
 
 #define tmp0  r1
 #define tmp1  r2
@@ -48,12 +108,62 @@ START:
 	MOV tmp1, 0xbeef1965				//
 	QBNE QUIT, tmp0, tmp1				// bail out if does not match
 
+	MOV tmp0, OFF_CONFIG_GEN			// generation of the configuration we are about to latch
+	LBBO gen, locals, tmp0, 4
+
 	LBBO out_buff, locals, 0x0c, 4
-	LBBO ema, locals, 0x1c, 4
-	LBBO encoders, locals, 0x40, 4
+	MOV ema, OFF_EMA_POWS
+	MOV tmp0, OFF_ENC_MAP
+	LBBO encoders, locals, tmp0, 4
 
 	// Read CAP_DELAY value into the register for convenience
 	LBBO cap_delay, locals, 0xc4, 4
+
+	LBBO seq, locals, OFF_SEQ, 4
+
+	// MAC in multiply-only mode (r25 is only read by XOUT)
+	MOV r25, 0
+	XOUT 0, r25, 1
+	CALL STATS_CLEAR
+
+	MOV tmp0, OFF_PERF
+	LBBO tmp1, tmp0, 0, 4
+	CALL PERF_CLEAR
+
+	// Enabled channels (zero means all 8)
+	MOV tmp0, OFF_CHANNELS
+	LBBO steps, locals, tmp0, 4
+	AND steps, steps, 0xff
+	QBNE COUNT_CHANNELS, steps, 0
+	MOV steps, 0xff
+COUNT_CHANNELS:
+	MOV nchannels, 0
+	MOV tmp0, 0
+COUNT_CHANNEL:
+	QBBC NEXT_COUNT_CHANNEL, steps, tmp0
+	ADD nchannels, nchannels, 1
+NEXT_COUNT_CHANNEL:
+	ADD tmp0, tmp0, 1
+	QBNE COUNT_CHANNEL, tmp0, 8
+	LSL steps, steps, 1                 // step N+1 samples AINn
+
+	// Start IEP timer: DEFAULT_INC=1, CNT_ENABLE=1
+	MOV tmp0, 0x11
+	SBCO tmp0, C26, IEP_GLOBAL_CFG, 4
+
+	// Cycle pacing: first cycle starts right away, next ones every `period` IEP clocks
+	MOV tmp0, OFF_PACE_PERIOD
+	LBBO period, locals, tmp0, 4
+	LBCO deadline, C26, IEP_COUNT, 4
+	MOV tmp0, OFF_PACE_START
+	SBBO deadline, locals, tmp0, 4
+	MOV tmp1, 0                         // new schedule: zero pace.max_late and pace.overruns
+	MOV tmp2, 0
+	SBBO &tmp1, tmp0, 4, 8
+
+	// Acknowledge configuration we have latched
+	MOV tmp0, OFF_CONFIG_ACK
+	SBBO gen, locals, tmp0, 4
 	
 	// Disable ADC
 	LBBO tmp0, adc_, CONTROL, 4
@@ -66,18 +176,22 @@ START:
 	MOV tmp0, 0
 	SBBO tmp0, adc_, SPEED, 4
 
-	// Configure STEPCONFIG registers for all 8 channels
+	// Configure STEPCONFIG and STEPDELAY registers for all 8 channels
 MOV tmp0, STEP1
 	MOV tmp1, 0
-	MOV tmp2, 0
+	MOV tmp4, OFF_STEP_CONFIG
 
 FILL_STEPS:
-	LSL tmp3, tmp1, 19
+	LBBO tmp2, tmp4, 0, 4               // step_config[n]: hardware averaging bits
+	LSL tmp3, tmp1, 19                  // step N+1 samples AINn
+	OR  tmp3, tmp3, tmp2
 	SBBO tmp3, adc_, tmp0, 4
 	ADD tmp0, tmp0, 4
+	LBBO tmp2, tmp4, 32, 4              // step_delay[n]: open delay and sample delay
 	SBBO tmp2, adc_, tmp0, 4
 	ADD tmp1, tmp1, 1
 	ADD tmp0, tmp0, 4
+	ADD tmp4, tmp4, 4
 	QBNE FILL_STEPS, tmp1, 8
 
 	// Enable ADC with the desired mode (make STEPCONFIG registers writable, use tags, enable)
@@ -86,12 +200,23 @@ FILL_STEPS:
 	SBBO tmp0, adc_, CONTROL, 4
 	
 CAPTURE:
+	LBCO tmp1, C26, IEP_COUNT, 4        // start of the loop, for performance counters
+	MOV tmp0, OFF_PERF_START
+	SBBO tmp1, locals, tmp0, 4
+
+	// check if host has changed configuration
+	MOV tmp0, OFF_CONFIG_GEN
+	LBBO tmp0, locals, tmp0, 4
+	QBNE RECONFIGURE, tmp0, gen
+CONFIGURED:
+
 	// check if we need to delay our main loop (to control capture frequency)
 	QBNE CAPTURE_DELAY, cap_delay, 0
 NO_DELAY:
+	QBNE CAPTURE_PACE, period, 0
+PACED:
 	
-	MOV tmp0, 0x1fe	
-	SBBO tmp0, adc_, STEPCONFIG, 4   // write STEPCONFIG register (this triggers capture)
+	SBBO steps, adc_, STEPCONFIG, 4   // write STEPCONFIG register (this triggers capture)
 
 	// check for exit flag
 	LBBO tmp0, locals, 0x08, 4   // read runtime flags
@@ -102,35 +227,93 @@ NO_DELAY:
 	LBBO tmp0, locals, 0x14, 4
 	QBEQ NO_SCOPE, tmp0, 0
 	
+	LBBO tmp2, locals, OFF_FRAME_COUNT, 4   // number of words in a multi-word frame
+	QBNE SCOPE_FRAME, tmp2, 0
+
+	SUB tmp0, tmp0, 4                       // single word at scope.offset
+	LBBO tmp1, locals, 0x10, 4
+	LBBO tmp1, locals, tmp1, 4
+	SBBO tmp1, out_buff, 0, 4
+	ADD out_buff, out_buff, 4
+	JMP SCOPE_EVENTS
+
+SCOPE_FRAME:                                // copy words listed in frame.offsets
+	MOV tmp3, OFF_FRAME_OFFSETS
+SCOPE_FRAME_WORD:
+	LBBO tmp1, locals, tmp3, 4
+	LBBO tmp1, locals, tmp1, 4
+	SBBO tmp1, out_buff, 0, 4
+	ADD out_buff, out_buff, 4
+	ADD tmp3, tmp3, 4
 	SUB tmp0, tmp0, 4
+	SUB tmp2, tmp2, 1
+	QBNE SCOPE_FRAME_WORD, tmp2, 0
+
+SCOPE_EVENTS:
+	// in streaming mode DDR buffer is a ring: publish number of frames written before notifying host,
+	// so that a woken host sees the frame that triggered the notification
+	LBBO tmp2, locals, OFF_STREAM_SIZE, 8   // tmp2 = stream.size, tmp3 = stream.head
+	QBEQ SCOPE_NOTIFY, tmp2, 0
+	ADD tmp3, tmp3, 1
+	SBBO tmp3, locals, OFF_STREAM_HEAD, 4
+
+SCOPE_NOTIFY:                               // notify host when buffer is half full and full
+	MOV tmp1, OFF_EVT_SCOPE_HALF
+	LBBO tmp1, locals, tmp1, 4
+	QBNE SCOPE_NOT_HALF, tmp0, tmp1
+	MOV evt, EVT_SCOPE_HALF
+	JAL evt_ret.w0, RAISE_EVENT
+SCOPE_NOT_HALF:
+	QBNE SCOPE_LENGTH, tmp0, 0
+	MOV evt, EVT_SCOPE_FULL
+	JAL evt_ret.w0, RAISE_EVENT
+
+	QBEQ SCOPE_LENGTH, tmp2, 0              // streaming: wrap around at the end of the ring
+	MOV tmp0, tmp2                          // restart from the beginning of the buffer
+	LBBO out_buff, locals, 0x0c, 4
+
+SCOPE_LENGTH:
 	SBBO tmp0, locals, 0x14, 4
-	LBBO tmp0, locals, 0x10, 4
-	LBBO tmp0, locals, tmp0, 4
-	SBBO tmp0, out_buff, 0, 4
-	ADD out_buff, out_buff, 4
 
 NO_SCOPE:
 
+	LBCO tmp1, C26, IEP_COUNT, 4
+WAIT_FOR_FIFO0:
+	LBBO tmp0, adc_, FIFO0COUNT, 4
+	QBNE WAIT_FOR_FIFO0, tmp0, nchannels
+	LBCO tmp0, C26, IEP_COUNT, 4
+
+	// Sequence counter is odd while we update timer, values, encoder state, statistics and performance counters.
+	// Host re-reads until it sees the same even counter before and after reading (seqlock).
+	ADD seq, seq, 1
+	SBBO seq, locals, OFF_SEQ, 4
+
+	SUB tmp0, tmp0, tmp1                // count time spent waiting (64 bit)
+	MOV tmp1, OFF_PERF_FIFO_WAIT
+	LBBO &tmp2, locals, tmp1, 8
+	ADD tmp2, tmp2, tmp0
+	ADC tmp3, tmp3, 0
+	SBBO &tmp2, locals, tmp1, 8
+
+	// time stamp of the values we are about to process
+	LBCO tmp0, C26, IEP_COUNT, 4
+	MOV tmp1, OFF_TIMESTAMP
+	SBBO tmp0, locals, tmp1, 4
+
 // increment ticks
 	LBBO tmp0, locals, 0x04, 4
 	ADD  tmp0, tmp0, 1
 	SBBO tmp0, locals, 0x04, 4
-	
-	// increment encoder ticks
-	LBBO tmp0, locals, 0x58, 8
-	ADD  tmp1, tmp1, 1
-	MAX  tmp0, tmp1, tmp0
-	SBBO tmp0, locals, 0x58, 8
-
-	LBBO tmp0, locals, 0x98, 8
-	ADD  tmp1, tmp1, 1
-	MAX  tmp0, tmp1, tmp0
-	SBBO tmp0, locals, 0x98, 8
-	SBBO tmp0, locals, 0x98, 8
 
-WAIT_FOR_FIFO0:
-	LBBO tmp0, adc_, FIFO0COUNT, 4
-	QBNE WAIT_FOR_FIFO0, tmp0, 8
+	// statistics: zero them if host asked for it, see if they are on
+	MOV tmp1, OFF_STATS_CTL
+	LBBO &tmp2, locals, tmp1, 12        // load tmp2-tmp4 with (enable, reset, reset_ack)
+	MOV stats, tmp2
+	QBEQ STATS_KEPT, tmp3, tmp4
+	CALL STATS_CLEAR
+STATS_KEPT:
+
+	MOV tmp0, nchannels                 // FIFO0 has values of all enabled channels
 
 READ_ALL_FIFO0:  // lets read all fifo content and dispatch depending on pin type
 	LBBO value, fifo0data, 0, 4
@@ -140,22 +323,47 @@ READ_ALL_FIFO0:  // lets read all fifo content and dispatch depending on pin typ
 	AND value, value, tmp1
 
 	// here we have true captured value and channel
-	QBNE NOT_ENC0, encoders.b0, channel
-	MOV channel, 0
-	CALL PROCESS
-	JMP NEXT_CHANNEL
+	QBEQ NO_STATS, stats, 0
+	MOV r28, value                      // MAC squares the value while we update min/max
+	MOV r29, value
+	LSL stat, channel, 5
+	MOV tmp1, OFF_STATS
+	ADD stat, stat, tmp1
+	LBBO &tmp1, stat, 0, 16             // load tmp1-tmp4 with (min, max, 64-bit count)
+	MIN tmp1, tmp1, value
+	MAX tmp2, tmp2, value
+	ADD tmp3, tmp3, 1
+	ADC tmp4, tmp4, 0
+	SBBO &tmp1, stat, 0, 16
+	LBBO &tmp1, stat, 16, 16            // load tmp1-tmp4 with 64-bit (sum, sumsq)
+	ADD tmp1, tmp1, value
+	ADC tmp2, tmp2, 0
+	XIN 0, r26, 4                       // value^2
+	ADD tmp3, tmp3, r26
+	ADC tmp4, tmp4, 0
+	SBBO &tmp1, stat, 16, 16
+NO_STATS:
 
-NOT_ENC0:
-	QBNE NOT_ENC1, encoders.b1, channel
-	MOV channel, 1
+	LSL tmp1, channel, 2   // to byte offset
+	LBBO tmp2, encoders, tmp1, 4 // enc_local of the encoder on this channel (zero: not an encoder)
+	QBEQ NOT_ENCODER, tmp2, 0
+	MOV channel, tmp2
+	LBCO mark, C26, IEP_COUNT, 4
 	CALL PROCESS
+	LBCO tmp1, C26, IEP_COUNT, 4        // count time spent in PROCESS (64 bit)
+	SUB tmp1, tmp1, mark
+	MOV tmp4, OFF_PERF_PROCESS
+	LBBO &tmp2, locals, tmp4, 8
+	ADD tmp2, tmp2, tmp1
+	ADC tmp3, tmp3, 0
+	SBBO &tmp2, locals, tmp4, 8
 	JMP NEXT_CHANNEL
 
-NOT_ENC1:
-	LSL tmp1, channel, 2   // to byte offset
+NOT_ENCODER:
+	LBBO tmp4, ema, tmp1, 4 // EMA exponent of this channel
 	ADD tmp1, tmp1, 0x20   // base of the EMA values
 	LBBO tmp2, locals, tmp1, 4
-	LSR tmp3, tmp2, ema
+	LSR tmp3, tmp2, tmp4
 	SUB tmp3, value, tmp3
 	ADD tmp2, tmp2, tmp3
 	SBBO tmp2, locals, tmp1, 4
@@ -164,12 +372,108 @@ NEXT_CHANNEL:
 	SUB tmp0, tmp0, 1
 	QBNE READ_ALL_FIFO0, tmp0, 0
 
+	// threshold crossing: watch the word at events.level_offset (zero disables)
+	MOV tmp1, OFF_EVT_LEVEL_OFFSET
+	LBBO &tmp1, locals, tmp1, 12        // load tmp1-tmp3 with (level_offset, level, above)
+	QBEQ NO_LEVEL, tmp1, 0
+	LBBO tmp1, locals, tmp1, 4
+	MOV tmp4, 0
+	QBGE LEVEL_BELOW, tmp1, tmp2        // value <= level
+	MOV tmp4, 1
+LEVEL_BELOW:
+	QBEQ NO_LEVEL, tmp4, tmp3
+	MOV tmp1, OFF_EVT_ABOVE
+	SBBO tmp4, locals, tmp1, 4
+	MOV evt, EVT_THRESHOLD
+	JAL evt_ret.w0, RAISE_EVENT
+NO_LEVEL:
+
+	// performance counters: zero them if host asked for it, then account this loop
+	MOV tmp0, OFF_PERF
+	LBBO &tmp1, tmp0, 0, 8              // load tmp1-tmp2 with (reset, reset_ack)
+	QBEQ PERF_KEPT, tmp1, tmp2
+	CALL PERF_CLEAR
+PERF_KEPT:
+	LBCO tmp1, C26, IEP_COUNT, 4
+	LBBO tmp2, tmp0, 8, 4               // loop_start
+	SUB tmp1, tmp1, tmp2                // length of this loop
+	LBBO &tmp2, tmp0, 20, 8             // load tmp2-tmp3 with (loop_min, loop_max)
+	MIN tmp2, tmp2, tmp1
+	MAX tmp3, tmp3, tmp1
+	SBBO &tmp1, tmp0, 16, 12            // loop_last, loop_min, loop_max
+	LBBO tmp4, tmp0, 12, 4
+	ADD tmp4, tmp4, 1
+	SBBO tmp4, tmp0, 12, 4              // loops
+
+	LBBO tmp1, adc_, IRQSTATUS_RAW, 4   // ADC FIFO0 overrun (bit 3) and underflow (bit 4)
+	AND tmp1, tmp1, 0x18
+	QBEQ PERF_DONE, tmp1, 0
+	SBBO tmp1, adc_, IRQSTATUS, 4       // clear them
+	LBBO &tmp2, tmp0, 28, 8             // load tmp2-tmp3 with (fifo_overflow, fifo_underflow)
+	QBBC PERF_NO_OVERFLOW, tmp1, 3
+	ADD tmp2, tmp2, 1
+PERF_NO_OVERFLOW:
+	QBBC PERF_NO_UNDERFLOW, tmp1, 4
+	ADD tmp3, tmp3, 1
+PERF_NO_UNDERFLOW:
+	SBBO &tmp2, tmp0, 28, 8
+PERF_DONE:
+
+	ADD seq, seq, 1                     // even again: values and counters are consistent
+	SBBO seq, locals, OFF_SEQ, 4
+
 JMP CAPTURE
 
 QUIT:
+	MOV evt, EVT_QUIT
+	JAL evt_ret.w0, RAISE_EVENT
 	MOV R31.b0, PRU0_ARM_INTERRUPT+16   // Send notification to Host for program completion
 	HALT
 
+RAISE_EVENT:                            // count event `evt` and interrupt host if it is enabled in events.mask
+	LSL evt_tmp0, evt, 2
+	MOV evt_tmp1, OFF_EVT_COUNT
+	ADD evt_tmp0, evt_tmp0, evt_tmp1
+	LBBO evt_tmp1, locals, evt_tmp0, 4
+	ADD evt_tmp1, evt_tmp1, 1
+	SBBO evt_tmp1, locals, evt_tmp0, 4
+	MOV evt_tmp0, OFF_EVT_MASK
+	LBBO evt_tmp1, locals, evt_tmp0, 4
+	QBBC RAISE_DONE, evt_tmp1, evt
+	MOV R31.b0, PRU0_ARM_INTERRUPT+16
+RAISE_DONE:
+	JMP evt_ret.w0
+
+STATS_CLEAR:                            // zero statistics of all channels and acknowledge stats_ctl.reset
+	MOV tmp2, 0xffffffff                // min
+	MOV tmp3, 0                         // max, count, sum, sumsq
+	MOV tmp4, 0
+	MOV tmp1, OFF_STATS
+	MOV value, OFF_STATS_END
+STATS_CLEAR_CHANNEL:
+	SBBO &tmp2, tmp1, 0, 12
+	SBBO &tmp3, tmp1, 12, 8
+	SBBO &tmp3, tmp1, 20, 8
+	SBBO tmp3, tmp1, 28, 4
+	ADD tmp1, tmp1, 32
+	QBNE STATS_CLEAR_CHANNEL, tmp1, value
+	MOV tmp1, OFF_STATS_RESET
+	LBBO tmp2, tmp1, 0, 4
+	SBBO tmp2, tmp1, 4, 4               // reset_ack = reset
+	RET
+
+PERF_CLEAR:                             // zero performance counters at tmp0 and acknowledge perf.reset (in tmp1)
+	SBBO tmp1, tmp0, 4, 4               // reset_ack = reset
+	MOV tmp1, 0                         // loops, loop_last
+	MOV tmp2, 0
+	MOV tmp3, 0xffffffff                // loop_min
+	MOV tmp4, 0                         // loop_max
+	SBBO &tmp1, tmp0, 12, 16
+	MOV tmp3, 0
+	SBBO &tmp1, tmp0, 28, 16            // fifo_overflow, fifo_underflow, fifo_wait
+	SBBO &tmp1, tmp0, 44, 8             // process
+	RET
+
 CAPTURE_DELAY:
 	MOV tmp0, cap_delay
 DELAY_LOOP:
@@ -177,9 +481,42 @@ DELAY_LOOP:
 	QBNE DELAY_LOOP, tmp0, 0
 	JMP NO_DELAY
 
-PROCESS:                                // lets process wheel encoder value
-	LSL channel, channel, 6
-	ADD channel, channel, 0x44
+RECONFIGURE:                            // re-latch configuration registers (see Capture.reconfigure())
+	MOV gen, tmp0
+	MOV tmp0, OFF_ENC_MAP
+	LBBO encoders, locals, tmp0, 4
+	LBBO cap_delay, locals, 0xc4, 4
+	MOV tmp0, OFF_PACE_PERIOD
+	LBBO period, locals, tmp0, 4
+	LBCO deadline, C26, IEP_COUNT, 4    // restart schedule
+	MOV tmp0, OFF_PACE_MAX_LATE
+	MOV tmp1, 0                         // and measure its jitter and overruns afresh
+	MOV tmp2, 0
+	SBBO &tmp1, tmp0, 0, 8
+	MOV tmp0, OFF_CONFIG_ACK
+	SBBO gen, locals, tmp0, 4
+	JMP CONFIGURED
+
+CAPTURE_PACE:                           // spin until the scheduled start of this cycle
+	LBCO tmp0, C26, IEP_COUNT, 4
+	SUB tmp1, tmp0, deadline            // how late we are (negative: still early)
+	QBBS CAPTURE_PACE, tmp1, 31
+	MOV tmp2, OFF_PACE_MAX_LATE
+	LBBO &tmp3, locals, tmp2, 8         // load tmp3-tmp4 with (max_late, overruns)
+	MAX tmp3, tmp3, tmp1
+	ADD deadline, deadline, period
+	QBLT PACE_ON_TIME, period, tmp1     // late by less than a period
+	ADD tmp4, tmp4, 1                   // missed a slot: count it and restart schedule from now
+	ADD deadline, tmp0, period
+PACE_ON_TIME:
+	SBBO &tmp3, locals, tmp2, 8
+	JMP PACED
+
+PROCESS:                                // lets process wheel encoder value, `channel` is the address of its enc_local
+	LBBO &tmp1, channel, 20, 8          // load tmp1-tmp2 (speed, acc)
+	ADD tmp2, tmp2, 1                   // acc++
+	MAX tmp1, tmp2, tmp1                // speed can not be less than the time since last tick
+	SBBO &tmp1, channel, 20, 8
 	LBBO &tmp1, locals, channel, 16     // load tmp1-tmp4 (threshold, raw, min, max)
 	MOV tmp2, value
 	MIN tmp3, tmp3, value
@@ -234,7 +571,17 @@ TOLOW:
 	MOV tmp3, tmp4                   // speed = acc
 	MOV tmp4, 0                      // acc = 0
 	SBBO &tmp2, locals, channel, 12
-	RET
+	SUB tmp1, tmp2, 1
+	AND tmp1, tmp1, TICK_RING_MASK   // slot of this tick in the tick ring
+	LSL tmp1, tmp1, 2
+	LBBO tmp3, channel, 40, 4        // tick_ring
+	LBBO tmp4, locals, 0x04, 4       // timer
+	SBBO tmp4, tmp3, tmp1, 4
+	MOV evt, EVT_TICK
+	JAL evt_ret.w0, RAISE_EVENT
+	SUB channel, channel, 16
+	MOV tmp1, 0                      // new level: low
+	JMP QUADRATURE
 	
 TOHIGH:
 	MOV tmp3, 0
@@ -245,5 +592,30 @@ TOHIGH:
 	MOV tmp2, value                  // min = max = value
 	MOV tmp3, value
 	SBBO &tmp2, locals, channel, 8
+	SUB channel, channel, 8
+	MOV tmp1, 1                      // new level: high
+
+QUADRATURE:                          // Schmitt trigger of enc_local at `channel` switched to level tmp1
+	SBBO tmp1, channel, 40, 4        // level
+	LBBO tmp2, channel, 44, 4        // quad: partner's enc_local, bit 0 set if we are channel B
+	QBEQ QUAD_DONE, tmp2, 0
+	CLR tmp3, tmp2, 0
+	LBBO tmp4, tmp3, 40, 4           // partner's level
+	XOR tmp4, tmp4, tmp1             // 1 if levels differ after this edge
+	QBBS QUAD_B, tmp2, 0
+	MOV tmp3, channel                // edge on A: moving forward if A differs from B
+	JMP QUAD_STEP
+QUAD_B:
+	XOR tmp4, tmp4, 1                // edge on B: moving forward if B equals A
+QUAD_STEP:                           // tmp3: enc_local of channel A, tmp4: 1 - forward, 0 - backward
+	LBBO value, tmp3, 48, 4          // position
+	ADD value, value, 1
+	MOV channel, 1
+	QBEQ QUAD_STORE, tmp4, 1
+	SUB value, value, 2
+	MOV channel, 0xffffffff
+QUAD_STORE:
+	SBBO &value, tmp3, 48, 8         // position, direction
+QUAD_DONE:
 	RET
 
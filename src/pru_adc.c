@@ -7,15 +7,22 @@
 
 #include <Python.h>
 #include <stddef.h>
+#include <errno.h>
+#include <poll.h>
+#include <unistd.h>
+#include <time.h>
 
 #include "prussdrv.h"
 #include "pruss_intc_mapping.h"
 #include "firmware.h"
 
+#define PRU_DATARAM_SIZE 0x2000 // size of PRU0 data RAM
+
 typedef struct {
 	PyObject_HEAD
 	
 	locals_t locals;
+	volatile locals_t *mem; // PRU0 data RAM, as mapped by prussdrv
 	
 	int started;
 	int closed;
@@ -34,9 +41,11 @@ static void Capture_dealloc(Capture	 *self) {
 
 static int Capture_init(Capture *self, PyObject *args, PyObject *kwds) {
 	tpruss_intc_initdata pruss_intc_initdata = PRUSS_INTC_INITDATA;
-	int rc;
+	void *address = NULL;
+	int rc, i;
 	
 	self->closed = 1; // consider closed unless successfully init everything
+	self->mem = NULL;
 	
 	rc = prussdrv_init ();
 	if (rc != 0) {
@@ -63,13 +72,14 @@ static int Capture_init(Capture *self, PyObject *args, PyObject *kwds) {
 	self->locals.enc.encoder0 = 0xff; // assigning out-of-range pin number disables encoder logic
 	self->locals.enc.encoder1 = 0xff; // ditto
 	
-	self->locals.enc_local[0].threshold = 2000;
-	self->locals.enc_local[0].speed = INITIAL_ACC_VAL;
-	self->locals.enc_local[0].acc = INITIAL_ACC_VAL;
-	
-	self->locals.enc_local[1].threshold = 2000;
-	self->locals.enc_local[1].speed = INITIAL_ACC_VAL;
-	self->locals.enc_local[1].acc = INITIAL_ACC_VAL;
+	for (i = 0; i < MAX_ENCODERS; i++) {
+		enc_local_t *enc = i < 2 ? &self->locals.enc_local[i] : &self->locals.enc_ext[i - 2];
+		enc->threshold = 2000;
+		enc->speed = INITIAL_ACC_VAL;
+		enc->acc = INITIAL_ACC_VAL;
+		enc->tick_ring = offsetof(locals_t, tick_ring[i]);
+	}
+	self->locals.encoders.map = offsetof(locals_t, encoders.maps[0]);
 	
 	rc = prussdrv_pru_write_memory(0, 0, (unsigned int *) &self->locals, sizeof(self->locals));
 	if (rc < 0) {
@@ -78,6 +88,14 @@ static int Capture_init(Capture *self, PyObject *args, PyObject *kwds) {
 		return -1;
 	}
 
+	rc = prussdrv_map_prumem(PRUSS0_PRU0_DATARAM, &address);
+	if (rc != 0) {
+		PyErr_SetString(PyExc_IOError, "Failed to map PRU 0 data RAM");
+		prussdrv_exit();
+		return -1;
+	}
+	self->mem = (volatile locals_t *) address;
+
 	self->closed = 0;
 	
 	return 0;
@@ -107,15 +125,317 @@ static PyObject *Capture_start(Capture *self, PyObject *args, PyObject *kwds) {
 	Py_RETURN_NONE;
 }
 
-static PyObject *Capture_wait(Capture *self) {
+static double now(void) {
+	struct timespec ts;
+	
+	clock_gettime(CLOCK_MONOTONIC, &ts); // not affected by wall clock changes (NTP, date)
+	return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+static PyObject *Capture_wait(Capture *self, PyObject *args, PyObject *kwds) {
+	static char *kwlist[] = {"timeout", NULL};
+	PyObject *timeout_obj = Py_None;
+	double deadline = 0.0;
+	struct pollfd pfd;
+	unsigned int event_count;
+	int timeout_ms;
+	int rc;
+	
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|O", kwlist, &timeout_obj)) {
+		return NULL;
+	}
+	
+	if (timeout_obj != Py_None) {
+		double timeout = PyFloat_AsDouble(timeout_obj);
+		if (timeout == -1.0 && PyErr_Occurred()) {
+			return NULL;
+		}
+		deadline = now() + (timeout > 0.0 ? timeout : 0.0);
+	}
 	
 	if (!self->started) {
 		PyErr_SetString(PyExc_IOError, "Not started");
 		return NULL;
 	}
 	
-	prussdrv_pru_wait_event(0);		// Wait for the event. This blocks the thread.
-	prussdrv_pru_clear_event(0, 0);	// Clear the event. FIXME: parameter meaning???
+	pfd.fd = prussdrv_pru_event_fd(PRU_EVTOUT_0);
+	pfd.events = POLLIN;
+	
+	for (;;) {
+		timeout_ms = -1;
+		if (timeout_obj != Py_None) {
+			double remaining = deadline - now();
+			timeout_ms = remaining > 0.0 ? (int) (remaining * 1000.0 + 0.999) : 0; // round up
+		}
+		
+		Py_BEGIN_ALLOW_THREADS
+		rc = poll(&pfd, 1, timeout_ms);	// Wait for the event, letting other Python threads run
+		Py_END_ALLOW_THREADS
+		
+		if (rc >= 0) {
+			break;
+		}
+		if (errno != EINTR) {
+			return PyErr_SetFromErrno(PyExc_IOError);
+		}
+		if (PyErr_CheckSignals() < 0) {	// e.g. KeyboardInterrupt
+			return NULL;
+		}
+	}
+	
+	if (rc == 0) {
+		Py_RETURN_FALSE; // timed out
+	}
+	
+	if (read(pfd.fd, &event_count, sizeof(event_count)) < 0) {	// consume the interrupt
+		return PyErr_SetFromErrno(PyExc_IOError);
+	}
+	prussdrv_pru_clear_event(PRU_EVTOUT_0, PRU0_ARM_INTERRUPT);	// and re-arm it
+	
+	Py_RETURN_TRUE;
+}
+
+static PyObject *Capture_extmem(Capture *self) {
+	void *address = NULL;
+	
+	if (self->closed) {
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	prussdrv_map_extmem(&address);
+	
+	// NOTE: memory is unmapped by close(), buffer must not be used after that
+	return PyBuffer_FromReadWriteMemory(address, prussdrv_extmem_size());
+}
+
+static PyObject *Capture_dataram(Capture *self) {
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	// NOTE: memory is unmapped by close(), buffer must not be used after that
+	return PyBuffer_FromReadWriteMemory((void *) self->mem, PRU_DATARAM_SIZE);
+}
+
+/*
+ * Fast accessors of the fields that host reads on every iteration of its control loop. They read PRU memory
+ * directly, multi-word reads are done under the seqlock (see src/README.md).
+ */
+
+#define SEQ_BEGIN(mem) for (;;) { word seq_ = (mem)->seq; __sync_synchronize();
+#define SEQ_END(mem) __sync_synchronize(); if (!(seq_ & 1) && (mem)->seq == seq_) break; }
+
+static volatile enc_local_t *encoder_at(Capture *self, PyObject *index_obj) {
+	long index;
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	index = PyInt_AsLong(index_obj);
+	if (index == -1 && PyErr_Occurred()) {
+		return NULL;
+	}
+	if (index < 0 || index >= MAX_ENCODERS) {
+		PyErr_SetString(PyExc_ValueError, "encoder must be in range 0-7");
+		return NULL;
+	}
+	
+	return index < 2 ? &self->mem->enc_local[index] : &self->mem->enc_ext[index - 2];
+}
+
+static word *writable_words(PyObject *out, Py_ssize_t count) {
+	void *buf = NULL;
+	Py_ssize_t size = 0;
+	
+	if (PyObject_AsWriteBuffer(out, &buf, &size) < 0) {
+		return NULL;
+	}
+	if (size < count * (Py_ssize_t) sizeof(word)) {
+		PyErr_Format(PyExc_ValueError, "buffer is too small, need %d bytes", (int) (count * sizeof(word)));
+		return NULL;
+	}
+	
+	return (word *) buf;
+}
+
+static PyObject *Capture_get_timer(Capture *self, void *closure) {
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	return PyLong_FromUnsignedLong(self->mem->timer);
+}
+
+static PyObject *Capture_get_values(Capture *self, void *closure) {
+	word values[8];
+	int i;
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	SEQ_BEGIN(self->mem)
+		for (i = 0; i < 8; i++) {
+			values[i] = self->mem->ain_ema[i];
+		}
+	SEQ_END(self->mem)
+	
+	return Py_BuildValue("(kkkkkkkk)", values[0], values[1], values[2], values[3],
+		values[4], values[5], values[6], values[7]);
+}
+
+static PyObject *Capture_get_scope_length(Capture *self, void *closure) {
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	return PyLong_FromUnsignedLong(self->mem->scope.length);
+}
+
+static PyObject *Capture_get_stream_head(Capture *self, void *closure) {
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	return PyLong_FromUnsignedLong(self->mem->stream.head);
+}
+
+static PyObject *Capture_encoder_ticks(Capture *self, PyObject *index) {
+	volatile enc_local_t *enc = encoder_at(self, index);
+	
+	if (enc == NULL) {
+		return NULL;
+	}
+	
+	return PyLong_FromUnsignedLong(enc->ticks);
+}
+
+static PyObject *Capture_encoder_speed(Capture *self, PyObject *index) {
+	volatile enc_local_t *enc = encoder_at(self, index);
+	
+	if (enc == NULL) {
+		return NULL;
+	}
+	
+	return PyLong_FromUnsignedLong(enc->speed);
+}
+
+static PyObject *Capture_encoder_values(Capture *self, PyObject *index) {
+	volatile enc_local_t *enc = encoder_at(self, index);
+	word raw, min, max, ticks, speed;
+	
+	if (enc == NULL) {
+		return NULL;
+	}
+	
+	SEQ_BEGIN(self->mem)
+		raw = enc->raw;
+		min = enc->min;
+		max = enc->max;
+		ticks = enc->ticks;
+		speed = enc->speed;
+	SEQ_END(self->mem)
+	
+	return Py_BuildValue("(kkkkk)", raw, min, max, ticks, speed);
+}
+
+static PyObject *Capture_read_values(Capture *self, PyObject *out) {
+	word *words;
+	word timer;
+	int i;
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	words = writable_words(out, 8);
+	if (words == NULL) {
+		return NULL;
+	}
+	
+	SEQ_BEGIN(self->mem)
+		timer = self->mem->timer;
+		for (i = 0; i < 8; i++) {
+			words[i] = self->mem->ain_ema[i];
+		}
+	SEQ_END(self->mem)
+	
+	return PyLong_FromUnsignedLong(timer);
+}
+
+static PyObject *Capture_read_encoders(Capture *self, PyObject *out) {
+	volatile enc_local_t *enc;
+	word *words;
+	word timer;
+	int i;
+	
+	if (self->mem == NULL) { // closed, or not initialized
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	words = writable_words(out, 2 * MAX_ENCODERS);
+	if (words == NULL) {
+		return NULL;
+	}
+	
+	SEQ_BEGIN(self->mem)
+		timer = self->mem->timer;
+		for (i = 0; i < MAX_ENCODERS; i++) {
+			enc = i < 2 ? &self->mem->enc_local[i] : &self->mem->enc_ext[i - 2];
+			words[2*i] = enc->ticks;
+			words[2*i + 1] = enc->speed;
+		}
+	SEQ_END(self->mem)
+	
+	return PyLong_FromUnsignedLong(timer);
+}
+
+static PyObject *Capture_extmem_phys_addr(Capture *self) {
+	void *address = NULL;
+	
+	if (self->closed) {
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	prussdrv_map_extmem(&address);
+	
+	return PyLong_FromUnsignedLong(prussdrv_get_phys_addr(address));
+}
+
+static PyObject *Capture_fileno(Capture *self) {
+	
+	if (self->closed) {
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	// becomes readable when PRU0 sends PRU0_ARM_INTERRUPT
+	return PyInt_FromLong(prussdrv_pru_event_fd(PRU_EVTOUT_0));
+}
+
+static PyObject *Capture_clear_event(Capture *self) {
+	
+	if (self->closed) {
+		PyErr_SetString(PyExc_IOError, "Closed");
+		return NULL;
+	}
+	
+	prussdrv_pru_clear_event(PRU_EVTOUT_0, PRU0_ARM_INTERRUPT); // re-arms host interrupt
 	
 	Py_RETURN_NONE;
 }
@@ -123,6 +443,7 @@ static PyObject *Capture_wait(Capture *self) {
 static PyObject *Capture_close(Capture *self, PyObject *args, PyObject *kwds) {
 	if (!self->closed) {
 		self->closed = 1; // true
+		self->mem = NULL;
 		
 		prussdrv_exit();
 	}
@@ -132,8 +453,26 @@ static PyObject *Capture_close(Capture *self, PyObject *args, PyObject *kwds) {
 
 static PyMethodDef Capture_methods[] = {
 	{"start", (PyCFunction) Capture_start, METH_VARARGS, "Starts capturing ADC data"},
-	{"wait", (PyCFunction) Capture_wait, METH_NOARGS, "Waits for PRU0 interrupt"},
+	{"wait", (PyCFunction) Capture_wait, METH_VARARGS | METH_KEYWORDS, "Waits for PRU0 interrupt (at most `timeout` seconds). Returns False on timeout"},
 	{"close", (PyCFunction) Capture_close, METH_NOARGS, "closes Capture object"},
+	{"extmem", (PyCFunction) Capture_extmem, METH_NOARGS, "Returns read-write buffer mapped onto PRU external (DDR) memory"},
+	{"dataram", (PyCFunction) Capture_dataram, METH_NOARGS, "Returns read-write buffer mapped onto PRU0 data RAM (local memory of the firmware)"},
+	{"encoder_ticks", (PyCFunction) Capture_encoder_ticks, METH_O, "Returns ticks of encoder (0-7)"},
+	{"encoder_speed", (PyCFunction) Capture_encoder_speed, METH_O, "Returns speed of encoder (0-7)"},
+	{"encoder_values", (PyCFunction) Capture_encoder_values, METH_O, "Returns (raw, min, max, ticks, speed) of encoder (0-7)"},
+	{"read_values", (PyCFunction) Capture_read_values, METH_O, "Copies 8 ADC values into writable buffer, returns timer"},
+	{"read_encoders", (PyCFunction) Capture_read_encoders, METH_O, "Copies (ticks, speed) of all encoders into writable buffer, returns timer"},
+	{"extmem_phys_addr", (PyCFunction) Capture_extmem_phys_addr, METH_NOARGS, "Returns physical address of PRU external (DDR) memory"},
+	{"fileno", (PyCFunction) Capture_fileno, METH_NOARGS, "Returns file descriptor that becomes readable when PRU0 interrupts host"},
+	{"clear_event", (PyCFunction) Capture_clear_event, METH_NOARGS, "Clears PRU0 interrupt so that it can fire again"},
+	{NULL}  /* Sentinel */
+};
+
+static PyGetSetDef Capture_getset[] = {
+	{"timer", (getter) Capture_get_timer, NULL, "ADC timer: number of capture cycles since start", NULL},
+	{"values", (getter) Capture_get_values, NULL, "Tuple of 8 ADC values (read under seqlock)", NULL},
+	{"scope_length", (getter) Capture_get_scope_length, NULL, "Bytes left to capture in the oscilloscope buffer", NULL},
+	{"stream_head", (getter) Capture_get_stream_head, NULL, "Number of frames streamed since streaming started", NULL},
 	{NULL}  /* Sentinel */
 };
 
@@ -168,7 +507,7 @@ static PyTypeObject CaptureType = {
 	0,					   /* tp_iternext */
 	Capture_methods,	   /* tp_methods */
 	0,						 /* tp_members */
-	0,						 /* tp_getset */
+	Capture_getset,		   /* tp_getset */
 	0,						 /* tp_base */
 	0,						 /* tp_dict */
 	0,						 /* tp_descr_get */
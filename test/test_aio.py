@@ -0,0 +1,117 @@
+"""
+Tests for asyncio integration (Python 3), run against the simulated backend
+"""
+import asyncio
+
+import beaglebone_pru_adc as adc
+from beaglebone_pru_adc import aio, sim
+
+
+def _run(coro):
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(coro)
+	finally:
+		loop.close()
+
+
+def test_encoder_ticks():
+	async def main():
+		capture = adc.Capture(backend=sim.SimulatedBackend(source=sim.square_wave(100, channels=(0,)), rate=20000))
+		capture.encoder0_pin = 0
+		acapture = aio.AsyncCapture(capture)
+		capture.start()
+		ticks = []
+		async for tick in acapture.encoder_ticks(0):
+			ticks.append(tick)
+			if tick.ticks >= 10:
+				break
+		assert await acapture.stop(timeout=5)
+		events = capture.events() # not consumed by AsyncCapture
+		assert events[adc.EVT_TICK] >= ticks[-1].ticks
+		assert events[adc.EVT_QUIT] == 1
+		acapture.close()
+		capture.close()
+		return ticks
+
+	ticks = _run(main())
+	assert ticks[-1].ticks >= 10
+	assert len(ticks) > 5 # woken up by ticks, not just at the end
+	assert all(t.speed == 100 for t in ticks[1:])
+	assert all(a.timer < b.timer for a, b in zip(ticks, ticks[1:]))
+
+
+def test_stream():
+	async def main():
+		capture = adc.Capture(backend=sim.SimulatedBackend(rate=20000))
+		capture.oscilloscope_init(adc.OFF_TIMER, 4000, streaming=True)
+		acapture = aio.AsyncCapture(capture)
+		capture.start()
+		expected = 0
+		async for chunk in acapture.stream():
+			assert list(chunk) == list(range(expected, expected + len(chunk)))
+			expected += len(chunk)
+			if expected >= 5000:
+				assert await acapture.stop(timeout=5)
+		assert expected == capture.timer
+		acapture.close()
+		capture.close()
+
+	_run(main())
+
+
+def test_stream_late_consumer():
+	async def main():
+		capture = adc.Capture(backend=sim.SimulatedBackend())
+		capture.oscilloscope_init(adc.OFF_TIMER, 40, streaming=True)
+		acapture = aio.AsyncCapture(capture)
+		scope = acapture.stream()
+		capture._backend.step(22) # consumer wakes up two samples after EVT_SCOPE_HALF
+		chunk = await scope.__anext__()
+		assert list(chunk) == list(range(20)) # ends at the middle of the ring
+		pending = asyncio.ensure_future(scope.__anext__())
+		await asyncio.sleep(0) # consumer is done with the chunk and waits for the next notification
+		capture._backend.step(18) # EVT_SCOPE_FULL: the rest of the first lap is there
+		chunk = await asyncio.wait_for(pending, 1)
+		assert list(chunk) == list(range(20, 40))
+		await scope.aclose()
+		acapture.close()
+		capture.close()
+
+	_run(main())
+
+
+def test_event_mask_restored():
+	async def main():
+		capture = adc.Capture(backend=sim.SimulatedBackend(source=sim.square_wave(100, channels=(0,)), rate=20000))
+		capture.encoder0_pin = 0
+		capture.event_mask = 1 << adc.EVT_TICK # enabled by user: must stay on
+		capture.oscilloscope_init(adc.OFF_TIMER, 100, streaming=True)
+		acapture = aio.AsyncCapture(capture)
+		capture.start()
+		ticks = acapture.encoder_ticks(0)
+		await ticks.__anext__()
+		scope = acapture.stream()
+		await scope.__anext__()
+		assert capture.event_mask == (1 << adc.EVT_TICK) | (1 << adc.EVT_SCOPE_HALF) | (1 << adc.EVT_SCOPE_FULL)
+		await scope.aclose()
+		assert capture.event_mask == 1 << adc.EVT_TICK
+		await ticks.aclose()
+		assert capture.event_mask == 1 << adc.EVT_TICK
+		assert await acapture.stop(timeout=5)
+		acapture.close()
+		capture.close()
+
+	_run(main())
+
+
+def test_stop_timeout():
+	async def main():
+		capture = adc.Capture(backend=sim.SimulatedBackend())
+		acapture = aio.AsyncCapture(capture)
+		# firmware was never started, so it will not stop
+		assert not await acapture.stop(timeout=0.05)
+		acapture.close()
+		capture.close()
+
+	_run(main())
@@ -0,0 +1,908 @@
+"""
+Tests that run the driver against the simulated backend (no BeagleBone required)
+"""
+import time
+
+import array
+import ctypes
+import select
+import struct
+import sys
+
+import beaglebone_pru_adc as adc
+from beaglebone_pru_adc import layout, sim
+
+
+def _capture(source=None, **kwargs):
+	return adc.Capture(backend=sim.SimulatedBackend(source=source, **kwargs))
+
+
+def _run(capture, cycles):
+	capture.start()
+	while capture.timer < cycles:
+		time.sleep(0.001)
+	capture.stop()
+	capture.wait()
+
+
+def _step(capture, cycles):
+	assert capture._backend.step(cycles)
+
+
+def test_initial_image():
+	capture = _capture()
+	assert capture.timer == 0
+	assert capture.encoder0_pin == -1
+	assert capture.encoder1_pin == -1
+	assert capture.encoder0_threshold == 2000
+	assert capture.encoder0_speed == sim.INITIAL_ACC_VAL
+	capture.close()
+
+
+def test_values_no_ema():
+	capture = _capture(sim.constant(range(100, 900, 100)))
+	_step(capture, 10)
+	assert capture.values == tuple(range(100, 900, 100))
+	capture.close()
+
+
+def test_values_ema():
+	capture = _capture(sim.constant([1000] * 8))
+	capture.ema_pow = 2
+	_step(capture, 1000)
+	# EMA value converges to value * 2^ema_pow
+	assert capture.values == (4000,) * 8
+	capture.close()
+
+
+def test_values_ema_per_channel():
+	capture = _capture(sim.constant([1000] * 8))
+	capture.ema_pow = [0, 1, 2, 3, 4, 5, 6, 7]
+	assert capture.ema_pow == (0, 1, 2, 3, 4, 5, 6, 7)
+	_step(capture, 5000)
+	assert capture.values == tuple(1000 << i for i in range(8))
+	capture.ema_pow = 3
+	assert capture.ema_pow == 3
+	capture.ema_pow = array.array('L', range(8))
+	assert capture.ema_pow == tuple(range(8))
+	try:
+		capture.ema_pow = [1] * 7
+		assert False, "must raise ValueError"
+	except ValueError as e:
+		assert str(e) == "ema_pow sequence must have 8 items, got 7"
+	capture.close()
+
+
+def test_stop_halts_firmware():
+	capture = _capture(rate=None)
+	_run(capture, 100)
+	timer = capture.timer
+	time.sleep(0.01)
+	assert capture.timer == timer
+	capture.close()
+
+
+def test_bad_eyecatcher_halts():
+	capture = _capture()
+	capture._set_word(0, 0)
+	capture.start()
+	capture.wait()
+	assert capture.timer == 0
+	capture.close()
+
+
+def test_encoder_ticks():
+	capture = _capture(sim.square_wave(100, channels=(0, 2)))
+	capture.encoder0_pin = 0
+	capture.encoder1_pin = 2
+	capture.encoder0_delay = 5
+	_step(capture, 1000)
+	assert capture.encoder0_ticks == 10
+	assert capture.encoder1_ticks == 10
+	assert capture.encoder0_speed == 100
+	assert capture.encoder1_speed == 100
+	assert capture.values[0] == 0 # encoder channels are not EMA-averaged
+	capture.close()
+
+
+def test_encoders():
+	capture = _capture(sim.square_wave(100, channels=(1, 3, 5, 7), base=[1000] * 8))
+	for encoder, pin in zip(capture.encoders[2:6], (1, 3, 5, 7)):
+		encoder.pin = pin
+	assert capture.encoder_pins == (None, None, 1, 3, 5, 7, None, None)
+	_step(capture, 1000)
+	for encoder in capture.encoders[2:6]:
+		assert encoder.ticks == 10
+		assert encoder.speed == 100
+		assert list(encoder.view) == list(encoder.values)
+	assert capture.encoders[0].ticks == 0
+	assert capture.values == (1000, 0, 1000, 0, 1000, 0, 1000, 0)
+	snap = capture.snapshot()
+	assert snap.enc_ext[3].ticks == 10
+	capture.close()
+
+
+def test_encoder_pins():
+	capture = _capture()
+	for pins in ([0, 0], [8], [None] * 9):
+		try:
+			capture.encoder_pins = pins
+			assert False, "must raise ValueError"
+		except ValueError:
+			pass
+	capture.encoder_pins = [3, 4]
+	assert capture.encoder0_pin == 3
+	assert capture.encoders[1].pin == 4
+	capture.encoder0_pin = -1
+	assert capture.encoders[0].pin is None
+	assert capture.snapshot().enc.encoder1 == 4
+	capture.close()
+
+
+def test_quadrature():
+	for reverse, direction in ((False, 1), (True, -1)):
+		capture = _capture(sim.quadrature_wave(100, channels=(2, 5), reverse=reverse))
+		capture.encoders[3].pin = 2
+		capture.encoders[6].pin = 5
+		capture.encoders[3].quadrature = 6
+		assert capture.encoders[6].quadrature is None # encoder 6 is channel B
+		_step(capture, 1000)
+		a = capture.encoders[3]
+		assert a.direction == direction
+		# 4 steps per period, first edges may come from the assumed initial state
+		assert 38 <= a.position * direction <= 42
+		assert a.ticks == capture.encoders[6].ticks == 10
+		a.quadrature = None
+		position = a.position
+		_step(capture, 100)
+		assert a.position == position
+		capture.close()
+
+
+def test_encoder_ticks_since():
+	capture = _capture(sim.square_wave(100, channels=(4,)))
+	capture.encoders[5].pin = 4
+	cursor, timers = capture.encoder_ticks_since(None, encoder=5)
+	assert cursor == 0 and len(timers) == 0
+	_step(capture, 1000)
+	cursor, timers = capture.encoder_ticks_since(cursor, encoder=5)
+	assert cursor == 10
+	assert list(timers) == list(range(50, 1000, 100)) # falling edges
+	_step(capture, 100)
+	cursor, timers = capture.encoders[5].ticks_since(cursor)
+	assert (cursor, list(timers)) == (11, [1050])
+	# ring keeps the last TICK_RING ticks only
+	_step(capture, 100 * adc.TICK_RING + 500)
+	old = cursor
+	cursor, timers = capture.encoders[5].ticks_since(cursor)
+	assert cursor - old == adc.TICK_RING + 5
+	assert len(timers) == adc.TICK_RING
+	assert timers[-1] == 100 * cursor - 50
+	capture.close()
+
+
+def test_stats():
+	capture = _capture(sim.square_wave(4, channels=(1,), low=1000, high=3000, base=[100 * i for i in range(8)]))
+	_step(capture, 10)
+	assert capture.stats() == (None,) * 8 # off by default
+	capture.stats_enabled = True
+	_step(capture, 1000)
+	stats = capture.stats(reset=True)
+	assert stats[3] == adc.ChannelStats(1000, 300, 300, 300.0, 0.0, 300.0, 0)
+	assert stats[1].count == 1000
+	assert (stats[1].min, stats[1].max, stats[1].peak_to_peak) == (1000, 3000, 2000)
+	assert stats[1].mean == 2000.0
+	assert stats[1].variance == 1000.0 ** 2
+	assert abs(stats[1].rms - (0.5 * (1000 ** 2 + 3000 ** 2)) ** 0.5) < 1e-9
+	_step(capture, 4)
+	assert [s.count for s in capture.stats()] == [4] * 8
+	struct.pack_into('=Q', capture._mem, layout.locals_t.stats.offset + 32 + layout.stats_t.count.offset, 0xffffffff)
+	_step(capture, 1)
+	assert capture.stats()[1].count == 1 << 32 # 64-bit count does not wrap around after 6 hours at 200kHz
+	capture.stats_enabled = False
+	capture.stats_reset()
+	_step(capture, 4)
+	assert capture.stats() == (None,) * 8
+	capture.close()
+
+
+def test_perf_counters():
+	capture = _capture()
+	capture.cap_delay = 100
+	_step(capture, 10)
+	perf = capture.perf_counters(reset=True)
+	assert perf == adc.PerfCounters(10, 1200, 1200, 1200, 10 * 1000, 0, 0, 0, 0)
+	assert capture.perf_counters().loops == 10 # firmware zeroes them on the next loop
+	_step(capture, 3)
+	assert capture.perf_counters().loops == 3
+	capture.perf_reset()
+	assert capture.perf_counters().loop_min == 1200
+	capture.close()
+	# oscilloscope samples lost by the consumer
+	capture = _capture()
+	capture.oscilloscope_init(adc.OFF_TIMER, 100, streaming=True)
+	_step(capture, 10)
+	stream = capture.stream(chunksize=10)
+	assert len(next(stream)) == 10
+	_step(capture, 150)
+	try:
+		next(stream)
+		assert False, "overrun not detected"
+	except adc.OverrunError:
+		pass
+	perf = capture.perf_counters(reset=True)
+	assert (perf.loops, perf.scope_dropped) == (160, 160) # the chunk we got was overwritten too
+	assert capture.perf_counters().scope_dropped == 0
+	capture.close()
+
+
+def test_scope_address_latched():
+	capture = _capture()
+	_step(capture, 1) # firmware latched the scope address before the buffer was set up
+	capture.oscilloscope_init(adc.OFF_TIMER, 10)
+	try:
+		capture._backend.step(1)
+		assert False, "write outside of DDR not detected"
+	except IOError:
+		pass
+	capture.close()
+
+
+def test_threshold_tracker():
+	capture = _capture(sim.square_wave(100, channels=(0,), low=1000, high=3000))
+	capture.encoder0_pin = 0
+	capture.encoder0_threshold = 4096 # never ticks
+	tracker = adc.ThresholdTracker(capture, window=2)
+	_step(capture, 1000)
+	tracker.update()
+	assert capture.encoder0_ticks == 0
+	assert capture.encoder0_threshold == 1400
+	_step(capture, 1000)
+	tracker.update()
+	assert capture.encoder0_ticks == 10
+	assert capture.encoder0_delay == 10 # tenth of the tick
+	state = tracker.state()[0]
+	assert (state.threshold, state.delay, state.low, state.high) == (1400, 10, 1000, 3000)
+	assert (state.updates, state.intervals, state.idle, state.drift) == (2, 2, 0, 0.0)
+
+	# signal drifts up, old envelope leaves the window
+	capture._backend.firmware.source = sim.square_wave(100, channels=(0,), low=1600, high=3400)
+	for _ in range(3):
+		_step(capture, 1000)
+		tracker.update()
+	state = tracker.state()[0]
+	assert (state.low, state.high, state.threshold, state.drift) == (1600, 3400, 1260, 500.0)
+	assert capture.encoder0_ticks == 40
+
+	# wheel stops: settings stay
+	capture._backend.firmware.source = sim.constant([2000] * 8)
+	_step(capture, 1000)
+	tracker.update()
+	state = tracker.state()[0]
+	assert (state.threshold, state.idle) == (1260, 1)
+	capture.close()
+
+
+def test_auto_threshold():
+	capture = _capture(sim.square_wave(100, channels=(2,), low=1000, high=3000), rate=None)
+	capture.encoders[4].pin = 2
+	capture.encoders[4].threshold = 4096
+	assert capture.auto_threshold_state() == {}
+	capture.start()
+	capture.auto_threshold_init(interval=0.01)
+	deadline = time.time() + 5
+	while capture.encoders[4].ticks < 10 and time.time() < deadline:
+		time.sleep(0.01)
+	assert capture.encoders[4].threshold == 1400
+	assert capture.auto_threshold_state()[4].updates >= 1
+	capture.stop()
+	capture.wait()
+	capture.close() # stops tracker too
+	assert capture.auto_threshold_state() == {}
+
+
+def test_rate_and_cap_delay():
+	capture = _capture(rate=1000)
+	capture.cap_delay = 100000 # adds 1ms to every cycle
+	capture.start()
+	time.sleep(0.5)
+	capture.stop()
+	capture.wait()
+	assert 150 < capture.timer < 350
+	capture.close()
+
+
+def test_oscilloscope():
+	capture = _capture(sim.recorded([[i] * 8 for i in range(4096)]))
+	capture.oscilloscope_init(adc.OFF_VALUES + 4, 100)
+	_step(capture, 150)
+	assert capture.oscilloscope_is_complete()
+	# scope records value of the previous cycle
+	assert list(capture.oscilloscope_data(100)) == list(range(0, 100))
+	capture.close()
+
+
+def test_layout_matches_offsets():
+	assert layout.locals_t.timer.offset == adc.OFF_TIMER
+	assert layout.locals_t.flags.offset == adc.OFF_FLAG
+	assert layout.locals_t.scope.offset == adc.OFF_SCOPE_ADDR
+	assert layout.locals_t.ema_pow.offset == adc.OFF_EMA_POW
+	assert layout.locals_t.ain_ema.offset == adc.OFF_VALUES
+	assert layout.locals_t.enc.offset == adc.OFF_ENC0_PIN
+	assert layout.locals_t.enc_local.offset == adc.OFF_ENC0_THRESH
+	assert layout.locals_t.enc_local.offset + ctypes.sizeof(layout.enc_local_t) == adc.OFF_ENC1_THRESH
+	assert layout.locals_t.cap_delay.offset == adc.OFF_CAP_DELAY
+	assert layout.locals_t.seq.offset == adc.OFF_SEQ
+	assert layout.locals_t.stream.offset == adc.OFF_STREAM_SIZE
+	assert layout.locals_t.frame.offset == adc.OFF_FRAME_COUNT
+	assert layout.locals_t.frame.offset + layout.frame_t.offsets.offset == adc.OFF_FRAME_OFFSETS
+	assert layout.locals_t.timestamp.offset == adc.OFF_TIMESTAMP
+	assert layout.locals_t.events.offset == adc.OFF_EVT_MASK
+	assert layout.locals_t.events.offset + layout.events_t.count.offset == adc.OFF_EVT_COUNT
+	assert layout.locals_t.channels.offset == adc.OFF_CHANNELS
+	assert layout.locals_t.step_config.offset == adc.OFF_STEP_CONFIG
+	assert layout.locals_t.step_delay.offset == adc.OFF_STEP_DELAY
+	assert layout.locals_t.pace.offset == adc.OFF_PACE_PERIOD
+	assert layout.locals_t.pace.offset + layout.pace_t.overruns.offset == adc.OFF_PACE_OVERRUNS
+	assert layout.locals_t.ema_pows.offset == adc.OFF_EMA_POWS
+	assert layout.locals_t.config.offset == adc.OFF_CONFIG_GEN
+	assert layout.locals_t.encoders.offset == adc.OFF_ENC_MAP
+	assert layout.locals_t.encoders.offset + layout.encoders_t.maps.offset == adc.OFF_ENC_MAPS
+	assert layout.locals_t.enc_ext.offset == adc.OFF_ENC_EXT
+	assert layout.MAX_ENCODERS == adc.MAX_ENCODERS
+	assert layout.locals_t.tick_ring.offset == adc.OFF_TICK_RING
+	assert layout.TICK_RING == adc.TICK_RING
+	assert layout.locals_t.stats_ctl.offset == adc.OFF_STATS_ENABLE
+	assert layout.locals_t.stats_ctl.offset + layout.stats_ctl_t.reset_ack.offset == adc.OFF_STATS_RESET_ACK
+	assert layout.locals_t.stats.offset == adc.OFF_STATS
+	assert ctypes.sizeof(layout.stats_t) == 32
+	assert layout.locals_t.perf.offset == adc.OFF_PERF
+	assert layout.locals_t.perf.offset + layout.perf_t.reset_ack.offset == adc.OFF_PERF_RESET_ACK
+	assert ctypes.sizeof(layout.perf_t) == 64
+
+
+def test_snapshot():
+	capture = _capture(sim.square_wave(100, channels=(0,), base=range(8)))
+	capture.encoder0_pin = 0
+	capture.ema_pow = 1
+	_step(capture, 1000)
+	snap = capture.snapshot()
+	assert snap.timer == capture.timer
+	assert tuple(snap.ain_ema) == capture.values
+	assert snap.enc.encoder0 == 0
+	assert snap.enc_local[0].ticks == capture.encoder0_ticks
+	assert snap.enc_local[0].speed == capture.encoder0_speed
+	assert snap.scope.length == 0
+	# buffer is reused
+	_step(capture, 10)
+	assert capture.snapshot() is snap
+	assert snap.timer == 1010
+	capture.close()
+
+
+def test_reads_are_not_torn():
+	# all channels carry the same value in every cycle, so any mix of two cycles is visible
+	capture = _capture(lambda timer: (timer & 0xfff,) * 8, rate=None)
+	if hasattr(sys, 'setswitchinterval'):
+		interval = sys.getswitchinterval()
+		sys.setswitchinterval(1e-5) # switch threads often to make torn reads likely
+	capture.start()
+	try:
+		deadline = time.time() + 0.5
+		while time.time() < deadline:
+			values = capture.values
+			assert values == (values[0],) * 8
+			snap = capture.snapshot()
+			assert tuple(snap.ain_ema) == ((snap.timer & 0xfff),) * 8
+			assert not snap.seq & 1
+	finally:
+		if hasattr(sys, 'setswitchinterval'):
+			sys.setswitchinterval(interval)
+	capture.stop()
+	capture.wait()
+	assert capture.snapshot().seq == 2 * capture.timer
+	capture.close()
+
+
+def test_views():
+	capture = _capture(sim.square_wave(100, channels=(1,), base=range(0, 800, 100)))
+	capture.encoder0_pin = 1
+	values = capture.values_view
+	encoder = capture.encoder0_view
+	assert len(values) == 8
+	assert len(encoder) == 5
+	_step(capture, 1)
+	assert list(values) == list(capture.values)
+	_step(capture, 1000)
+	# views are live
+	assert list(values) == list(capture.values)
+	assert list(encoder) == list(capture.encoder0_values)
+	assert encoder[3] == capture.encoder0_ticks == 10
+	assert list(capture.encoder1_view) == list(capture.encoder1_values)
+	capture.close()
+	if hasattr(memoryview, 'cast'): # Python 3 releases views on close (Python 2 can not, see values_view)
+		for view in (values, encoder):
+			try:
+				view[0]
+				assert False, "must raise ValueError"
+			except ValueError:
+				pass
+
+
+def test_stream():
+	capture = _capture(rate=None)
+	capture.oscilloscope_init(adc.OFF_TIMER, 1000, streaming=True)
+	capture.start()
+	expected = 0
+	for chunk in capture.stream(chunksize=100):
+		assert list(chunk) == list(range(expected, expected + len(chunk)))
+		expected += len(chunk)
+		if expected >= 5000:
+			capture.stop()
+	capture.wait()
+	assert expected == capture.timer
+	assert not capture.oscilloscope_is_complete()
+	capture.close()
+
+
+def test_stream_overrun():
+	capture = _capture()
+	capture.oscilloscope_init(adc.OFF_TIMER, 100, streaming=True)
+	_step(capture, 50)
+	stream = capture.stream(chunksize=10)
+	assert list(next(stream)) == list(range(50))
+	_step(capture, 40)
+	assert list(next(stream)) == list(range(50, 90))
+	_step(capture, 30)
+	assert list(next(stream)) == list(range(90, 100)) # up to the end of the ring
+	assert list(next(stream)) == list(range(100, 120))
+	_step(capture, 150)
+	try:
+		next(stream)
+		assert False, "overrun not detected"
+	except adc.OverrunError as e:
+		assert str(e) == "oscilloscope stream overrun, 170 samples lost" # 100-269 are skipped
+	# streaming resumes from the latest sample
+	_step(capture, 20)
+	assert list(next(capture.stream(chunksize=10))) == list(range(270, 290))
+	capture.close()
+
+
+def test_stream_chunk_overwritten():
+	capture = _capture()
+	capture.oscilloscope_init(adc.OFF_TIMER, 100, streaming=True)
+	_step(capture, 50)
+	stream = capture.stream(chunksize=10)
+	assert list(next(stream)) == list(range(50))
+	_step(capture, 60) # overwrites beginning of the chunk we got
+	try:
+		next(stream)
+		assert False, "overrun not detected"
+	except adc.OverrunError:
+		pass
+	# with the whole ring available the oldest frame may be half overwritten by the next one
+	_step(capture, 50)
+	stream = capture.stream(chunksize=10)
+	assert list(next(stream)) == list(range(110, 160))
+	_step(capture, 50) # head is exactly one ring ahead of the tail
+	try:
+		next(stream)
+		assert False, "overrun not detected"
+	except adc.OverrunError as e:
+		assert str(e) == "oscilloscope stream overrun, 100 samples lost"
+	capture.close()
+
+
+def test_oscilloscope_multichannel():
+	capture = _capture(sim.recorded([[i + 500 * c for c in range(8)] for i in range(500)]))
+	capture.oscilloscope_init([adc.OFF_TIMER, adc.OFF_VALUES, adc.OFF_VALUES + 28], 100)
+	_step(capture, 150)
+	assert capture.oscilloscope_is_complete()
+	timer, ain0, ain7 = capture.oscilloscope_data(100)
+	assert list(timer) == list(range(100))
+	assert list(ain0) == [0] + list(range(1, 100))
+	assert list(ain7) == [0] + list(range(3501, 3600))
+	capture.close()
+
+
+def test_stream_multichannel():
+	capture = _capture()
+	capture.oscilloscope_init([adc.OFF_TIMER, adc.OFF_SEQ], 100, streaming=True)
+	_step(capture, 50)
+	stream = capture.stream(chunksize=10)
+	next(stream)
+	_step(capture, 30)
+	timer, seq = next(stream)
+	assert list(timer) == list(range(50, 80))
+	assert list(seq) == [2 * t for t in timer]
+	capture.close()
+
+
+def test_oscilloscope_view_and_out():
+	capture = _capture()
+	capture.oscilloscope_init(adc.OFF_TIMER, 100)
+	_step(capture, 100)
+	view = capture.oscilloscope_view(100)
+	assert list(view) == list(range(100))
+	out = bytearray(400)
+	assert capture.oscilloscope_data(100, out=out) is out
+	assert list(array.array('I', bytes(out))) == list(range(100))
+	capture.close()
+	if hasattr(view, 'release'):
+		try:
+			view[0]
+			assert False, "view must be released by close()"
+		except ValueError:
+			pass
+
+
+def test_oscilloscope_timestamps():
+	capture = _capture(rate=100000) # 2000 IEP clocks per cycle
+	capture._backend.firmware.iep = 0xffffffff - 5000 # wraps around during capture
+	capture.oscilloscope_init(adc.OFF_TIMER, 100, timestamps=True)
+	_step(capture, 100)
+	assert list(capture.oscilloscope_data(100)) == list(range(100))
+	times = capture.oscilloscope_time(100)
+	# first frame is recorded before the first time stamp is taken
+	assert [round((t - times[1]) * 1e6) for t in times[1:]] == [10 * i for i in range(99)]
+	capture.close()
+
+
+def test_stream_timestamps():
+	capture = _capture(rate=100000)
+	capture.oscilloscope_init([adc.OFF_TIMER, adc.OFF_SEQ], 100, streaming=True, timestamps=True)
+	stream = capture.stream(chunksize=10)
+	_step(capture, 50)
+	times, (timer, seq) = next(stream)
+	assert list(timer) == list(range(50))
+	_step(capture, 30)
+	times, (timer, seq) = next(stream)
+	assert list(timer) == list(range(50, 80))
+	assert [round(t * 1e6) for t in times] == [10 * i for i in range(50, 80)]
+	capture.close()
+
+
+def _readable(capture):
+	return bool(select.select([capture.fileno()], [], [], 0)[0])
+
+
+def test_events():
+	capture = _capture(sim.square_wave(100, channels=(0,), base=range(0, 800, 100)))
+	capture.encoder0_pin = 0
+	capture.oscilloscope_init(adc.OFF_TIMER, 100)
+	capture.event_mask = 1 << adc.EVT_TICK
+	_step(capture, 149)
+	assert _readable(capture)
+	assert capture.events() == {adc.EVT_TICK: 1, adc.EVT_SCOPE_HALF: 1, adc.EVT_SCOPE_FULL: 1}
+	assert not _readable(capture)
+	assert capture.events() == {}
+	# events not in the mask are counted, but do not notify
+	capture.event_mask = 0
+	capture.threshold_init(adc.OFF_ENC0_VALUES, 2000) # raw value of encoder0, high now
+	_step(capture, 1)
+	assert not _readable(capture)
+	capture.event_mask = 1 << adc.EVT_THRESHOLD
+	_step(capture, 49)
+	assert not _readable(capture)
+	_step(capture, 1)
+	assert _readable(capture)
+	assert capture.events() == {adc.EVT_THRESHOLD: 2, adc.EVT_TICK: 1}
+	capture.stop()
+	assert not capture._backend.step(1)
+	assert _readable(capture) # quit always notifies
+	assert capture.events() == {adc.EVT_QUIT: 1}
+	capture.close()
+
+
+def test_stream_events_after_head():
+	capture = _capture()
+	capture.oscilloscope_init(adc.OFF_TIMER, 10, streaming=True)
+	capture.event_mask = (1 << adc.EVT_SCOPE_HALF) | (1 << adc.EVT_SCOPE_FULL)
+	firmware = capture._backend.firmware
+	irq, heads = firmware.irq, []
+	def record():
+		heads.append(capture._get_word(adc.OFF_STREAM_HEAD)) # host woken now must see the frame
+		irq()
+	firmware.irq = record
+	_step(capture, 20)
+	assert heads == [5, 10, 15, 20]
+	capture.close()
+
+
+def test_wait_timeout():
+	capture = _capture()
+	capture.start()
+	started = time.time()
+	assert capture.wait(0.05) is False
+	assert time.time() - started < 1
+	capture.stop()
+	assert capture.wait(5) is True
+	assert capture.wait() is True
+	capture.close()
+
+
+def test_channels():
+	capture = _capture(sim.constant(range(100, 900, 100)))
+	assert capture.channels == list(range(8))
+	capture.channels = [0, 2]
+	assert capture.channels == [0, 2]
+	_step(capture, 10)
+	assert capture.values == (100, 0, 300, 0, 0, 0, 0, 0) # disabled channels are not touched
+	for bad in ([], [8]):
+		try:
+			capture.channels = bad
+			assert False, "must raise ValueError"
+		except ValueError:
+			pass
+	capture.close()
+
+
+def test_channel_config():
+	capture = _capture()
+	assert capture.channel_config(3) == (1, 0, 0)
+	assert capture.channel_config(3, averaging=16, sample_delay=255) == (16, 0, 255)
+	assert capture.channel_config(3, open_delay=1000) == (16, 1000, 255)
+	snap = capture.snapshot()
+	assert snap.step_config[3] == 4 << 2
+	assert snap.step_delay[3] == (255 << 24) | 1000
+	assert list(snap.step_config[:3]) == [0, 0, 0]
+	for bad in ({'averaging': 3}, {'open_delay': 0x40000}, {'sample_delay': 256}):
+		try:
+			capture.channel_config(0, **bad)
+			assert False, "must raise ValueError"
+		except ValueError:
+			pass
+	capture.close()
+
+
+def test_sample_rate():
+	capture = _capture(rate=None) # cycle takes 1000 IEP clocks (5us) when not paced
+	assert capture.sample_rate_hz is None
+	capture.sample_rate_hz = 100000
+	assert capture.sample_rate_hz == 100000
+	_step(capture, 10)
+	capture.rate_stats()
+	_step(capture, 100)
+	stats = capture.rate_stats()
+	assert round(stats.rate_hz) == 100000
+	assert stats.jitter == 0
+	assert stats.overruns == 0
+	capture.close()
+
+
+def test_sample_rate_overrun():
+	capture = _capture(rate=None)
+	capture.sample_rate_hz = 400000 # faster than firmware can go
+	_step(capture, 100)
+	stats = capture.rate_stats()
+	assert round(stats.rate_hz) < 250000
+	assert stats.jitter == 2.5e-6
+	assert stats.overruns == 99
+	# new schedule: jitter and overruns of the old one are forgotten
+	capture.sample_rate_hz = 100000
+	_step(capture, 10)
+	stats = capture.rate_stats()
+	assert (stats.jitter, stats.overruns) == (0, 0)
+	capture.close()
+
+
+def test_reconfigure():
+	capture = _capture(sim.square_wave(100, channels=(0, 2)), rate=None)
+	capture.encoder0_pin = 0
+	capture.start()
+	while capture.encoder0_ticks < 2:
+		time.sleep(0.001)
+	assert capture.encoder1_ticks == 0
+	capture.reconfigure(encoder_pins=[None, 2], cap_delay=10)
+	snap = capture.snapshot()
+	assert snap.config.ack == snap.config.gen
+	ticks0 = capture.encoder0_ticks
+	while capture.encoder1_ticks < 2:
+		time.sleep(0.001)
+	assert capture.encoder0_ticks == ticks0 # encoder0 is off now
+	assert capture._backend.firmware.cap_delay == 10
+	try:
+		capture.reconfigure(encoder2_pin=1)
+		assert False, "must raise TypeError"
+	except TypeError:
+		pass
+	capture.stop()
+	capture.wait()
+	capture.close()
+
+
+def test_reconfigure_slow_rate():
+	capture = _capture(sim.constant([0] * 8), rate=1000)
+	capture.sample_rate_hz = 0.8 # next cycle, and the change with it, is up to 1.25s away
+	capture.start()
+	while capture.timer < 2:
+		time.sleep(0.001)
+	capture.encoder0_pin = 0
+	capture.encoder1_pin = 1 # waits for the firmware to pick up encoder0_pin
+	capture.reconfigure(cap_delay=10)
+	assert capture._backend.firmware.cap_delay == 10
+	capture.stop()
+	capture.wait()
+	capture.close()
+
+
+def test_setter_reconfigures():
+	capture = _capture(sim.square_wave(100, channels=(1,)))
+	_step(capture, 100)
+	capture.encoder0_pin = 1 # picked up by the next cycle
+	_step(capture, 200)
+	assert capture.encoder0_ticks == 2
+	capture.close()
+
+
+def test_bench():
+	from beaglebone_pru_adc import bench
+	report = bench.run('sim', samples=5)
+	assert report['backend'] == 'sim'
+	results = report['results']
+	for name in bench.PROPERTIES + ('snapshot',):
+		assert results['read.' + name]['samples'] == 5
+	assert results['read.snapshot']['per_second'] > 0
+	assert results['oscilloscope_data.1000']['mb_per_s'] > 0
+	for stats in results.values():
+		assert stats['min'] <= stats['p50'] <= stats['p90'] <= stats['p99'] <= stats['max']
+	assert bench.percentile([1, 2, 3, 4, 5], 0.5) == 3
+	assert bench.percentile([1, 2], 0.5) == 1.5
+
+
+def test_capes_loaded_lazily():
+	import tempfile
+	assert not adc._capes_ready # importing the package does not touch the board
+	saved = adc._slots_path, adc._pru_ready
+	with tempfile.NamedTemporaryFile('w', suffix='slots') as f:
+		adc._slots_path = f.name
+		adc._pru_ready = lambda: True
+		try:
+			adc._ensure_capes_loaded(timeout=0.05) # nothing listed, overlays are written but never show up
+			assert False, "must raise IOError"
+		except IOError:
+			pass
+		assert not adc._capes_ready
+		f.write(' 7: ff:P-O-L Override Board Name,00A0,Override Manuf,BB-BONE-PRU-01\n')
+		f.write(' 8: ff:P-O-L Override Board Name,00A0,Override Manuf,BB-ADC\n')
+		f.flush()
+		try:
+			adc._ensure_capes_loaded(timeout=0.05)
+			assert adc._capes_ready
+			adc._slots_path = '/nonexistent'
+			adc._ensure_capes_loaded() # cached, slots are not read again
+		finally:
+			adc._slots_path, adc._pru_ready = saved
+			adc._capes_ready = False
+
+
+def test_read_values():
+	capture = _capture(sim.square_wave(100, channels=(0,), base=range(8)))
+	capture.encoder_pins = [None, None, 0]
+	_step(capture, 250)
+	out = array.array('I', [0] * 8)
+	assert capture.read_values(out) == capture.timer == 250
+	assert tuple(out) == capture.values
+	out = bytearray(4 * 2 * adc.MAX_ENCODERS)
+	assert capture.read_encoders(out) == 250
+	words = array.array('I', bytes(out))
+	assert list(words[4:6]) == [capture.encoders[2].ticks, capture.encoders[2].speed] == [3, 100]
+	try:
+		capture.read_values(bytearray(16))
+		assert False, "must raise ValueError"
+	except ValueError:
+		pass
+	capture.close()
+
+
+class _FastStub(object):
+	"""
+	Python stand-in for the C accessors of _pru_adc.Capture (HardwareBackend.fast). Reads the same memory
+	image as the Python path and logs every call
+	"""
+
+	def __init__(self, mem):
+		self.mem = mem
+		self.calls = []
+
+	def _words(self, offset, count):
+		return struct.unpack_from('=%dL' % count, self.mem, offset)
+
+	@property
+	def timer(self):
+		self.calls.append('timer')
+		return self._words(adc.OFF_TIMER, 1)[0]
+
+	@property
+	def values(self):
+		self.calls.append('values')
+		return self._words(adc.OFF_VALUES, 8)
+
+	@property
+	def scope_length(self):
+		self.calls.append('scope_length')
+		return self._words(adc.OFF_SCOPE_SIZE, 1)[0]
+
+	@property
+	def stream_head(self):
+		self.calls.append('stream_head')
+		return self._words(adc.OFF_STREAM_HEAD, 1)[0]
+
+	def encoder_values(self, index):
+		self.calls.append(('encoder_values', index))
+		return self._words(adc._encoder_offset(index) + 4, 5)
+
+	def encoder_ticks(self, index):
+		self.calls.append(('encoder_ticks', index))
+		return self._words(adc._encoder_offset(index) + 16, 1)[0]
+
+	def encoder_speed(self, index):
+		self.calls.append(('encoder_speed', index))
+		return self._words(adc._encoder_offset(index) + 20, 1)[0]
+
+	def read_values(self, out):
+		self.calls.append('read_values')
+		struct.pack_into('=8L', out, 0, *self._words(adc.OFF_VALUES, 8))
+		return self._words(adc.OFF_TIMER, 1)[0]
+
+	def read_encoders(self, out):
+		self.calls.append('read_encoders')
+		for i in range(adc.MAX_ENCODERS):
+			struct.pack_into('=LL', out, 8 * i, *self._words(adc._encoder_offset(i) + 16, 2))
+		return self._words(adc.OFF_TIMER, 1)[0]
+
+
+class _FastBackend(sim.SimulatedBackend):
+	def __init__(self, *args, **kwargs):
+		sim.SimulatedBackend.__init__(self, *args, **kwargs)
+		self.fast = _FastStub(self.mem)
+
+
+def test_fast_accessors():
+	backend = _FastBackend(source=sim.square_wave(100, channels=(0,), base=range(8)))
+	capture = adc.Capture(backend=backend)
+	fast = backend.fast
+	assert capture._fast is fast
+	capture.encoder_pins = [None, None, 0]
+	capture.oscilloscope_init(adc.OFF_TIMER, 1000, streaming=True)
+	_step(capture, 250)
+
+	def read(func):
+		"""
+		Calls `func` with the fast accessors and without them. Checks both give the same result,
+		returns the result and calls made to the fast accessors
+		"""
+		fast.calls = []
+		result = func()
+		calls, fast.calls = fast.calls, []
+		capture._fast = None
+		try:
+			assert func() == result
+		finally:
+			capture._fast = fast
+		return result, calls
+
+	assert read(lambda: capture.timer) == (250, ['timer'])
+	assert read(lambda: capture.values)[1] == ['values']
+	encoder = capture.encoders[2]
+	assert read(lambda: encoder.ticks) == (3, [('encoder_ticks', 2)])
+	assert read(lambda: encoder.speed) == (100, [('encoder_speed', 2)])
+	values, calls = read(lambda: encoder.values)
+	assert values[3:] == (3, 100) and calls == [('encoder_values', 2)]
+
+	def read_values():
+		out = array.array('I', [0] * 8)
+		return capture.read_values(out), tuple(out)
+	(timer, values), calls = read(read_values)
+	assert timer == 250 and values == capture.values and calls == ['read_values']
+
+	def read_encoders():
+		out = array.array('I', [0] * 2 * adc.MAX_ENCODERS)
+		return capture.read_encoders(out), tuple(out)
+	(timer, words), calls = read(read_encoders)
+	assert timer == 250 and words[4:6] == (3, 100) and calls == ['read_encoders']
+
+	assert read(capture.oscilloscope_is_complete) == (False, ['scope_length'])
+	assert read(lambda: capture._stream_available(capture._stream_capacity())) == (250, ['stream_head'])
+	capture.close()
+	assert capture._fast is None